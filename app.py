@@ -8,20 +8,24 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
+import numpy as np
 import os
 
 from database import (
-    init_database, get_connection, 
-    create_agreement, update_agreement, get_agreement, get_all_agreements, delete_agreement,
-    create_po, get_pos_for_agreement, get_all_pos, delete_po,
+    init_database, pooled_connection,
+    create_agreement, update_agreement, get_agreement, delete_agreement,
+    create_po, transaction, bulk_create_agreements, bulk_create_pos, get_pos_for_agreement, get_all_pos, delete_po,
     get_pipeline_stats, get_monetization_stats, get_account_manager_stats,
-    get_aging_risk_matrix, get_forecast_data,
+    get_aging_risk_matrix, get_forecast_data, get_kpi_summary,
     export_agreements_csv, export_pos_csv,
+    AGREEMENTS_WITH_POS_TOTAL_SQL, AGREEMENTS_ORDER_SQL,
     AgreementStatus, CustomerSegment, AgreementType, Currency, RiskFlag,
-    PRE_SIGNATURE_STATUSES, POST_SIGNATURE_STATUSES, ALLOWED_STATUS_TRANSITIONS,
-    convert_to_sar
+    AGING_BUCKET_EDGES, AGING_BUCKET_LABELS, RISK_DAY_EDGES, RISK_FLAG_TABLE,
+    PRE_SIGNATURE_STATUSES, ALLOWED_STATUS_TRANSITIONS,
+    PRE_SIGNATURE_VALUES, POST_SIGNATURE_VALUES
 )
+from sample_data import reset_sample_data, clear_all_data
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE CONFIG & STYLING
@@ -35,147 +39,13 @@ st.set_page_config(
 )
 
 # Custom CSS for enhanced styling
-st.markdown("""
-<style>
-    /* Main container styling */
-    .main .block-container {
-        padding-top: 2rem;
-        padding-bottom: 2rem;
-    }
-    
-    /* Metric cards */
-    div[data-testid="metric-container"] {
-        background: linear-gradient(135deg, #1a1a2e 0%, #16213e 100%);
-        border: 1px solid #0f3460;
-        border-radius: 12px;
-        padding: 1rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-    }
-    
-    div[data-testid="metric-container"] label {
-        color: #94a3b8 !important;
-        font-size: 0.85rem !important;
-    }
-    
-    div[data-testid="metric-container"] div[data-testid="stMetricValue"] {
-        color: #e2e8f0 !important;
-        font-weight: 600;
-    }
-    
-    /* Risk badge colors */
-    .risk-green { 
-        background-color: #10b981; 
-        color: white; 
-        padding: 4px 12px; 
-        border-radius: 20px; 
-        font-size: 0.8rem;
-        font-weight: 600;
-    }
-    .risk-amber { 
-        background-color: #f59e0b; 
-        color: white; 
-        padding: 4px 12px; 
-        border-radius: 20px; 
-        font-size: 0.8rem;
-        font-weight: 600;
-    }
-    .risk-red { 
-        background-color: #ef4444; 
-        color: white; 
-        padding: 4px 12px; 
-        border-radius: 20px; 
-        font-size: 0.8rem;
-        font-weight: 600;
-    }
-    
-    /* Status badges */
-    .status-pipeline { background-color: #6366f1; }
-    .status-draft { background-color: #8b5cf6; }
-    .status-legal { background-color: #ec4899; }
-    .status-pending { background-color: #f97316; }
-    .status-signed { background-color: #10b981; }
-    .status-active { background-color: #06b6d4; }
-    .status-expired { background-color: #6b7280; }
-    
-    /* Section headers */
-    .section-header {
-        font-size: 1.5rem;
-        font-weight: 700;
-        color: #e2e8f0;
-        margin-bottom: 1rem;
-        padding-bottom: 0.5rem;
-        border-bottom: 2px solid #3b82f6;
-    }
-    
-    /* Cards */
-    .info-card {
-        background: linear-gradient(135deg, #1e293b 0%, #0f172a 100%);
-        border-radius: 12px;
-        padding: 1.5rem;
-        margin-bottom: 1rem;
-        border: 1px solid #334155;
-    }
-    
-    /* Tables */
-    .dataframe {
-        font-size: 0.85rem !important;
-    }
-    
-    /* Sidebar styling */
-    section[data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #0f172a 0%, #1e293b 100%);
-    }
-    
-    section[data-testid="stSidebar"] .stRadio label {
-        color: #e2e8f0 !important;
-    }
-    
-    /* Form styling */
-    .stForm {
-        background: #1e293b;
-        padding: 1.5rem;
-        border-radius: 12px;
-        border: 1px solid #334155;
-    }
-    
-    /* Button styling */
-    .stButton button {
-        background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%);
-        color: white;
-        border: none;
-        border-radius: 8px;
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-    
-    .stButton button:hover {
-        background: linear-gradient(135deg, #2563eb 0%, #1d4ed8 100%);
-        box-shadow: 0 4px 12px rgba(59, 130, 246, 0.4);
-    }
-    
-    /* Tab styling */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 8px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        background-color: #1e293b;
-        border-radius: 8px 8px 0 0;
-        color: #94a3b8;
-        border: 1px solid #334155;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background-color: #3b82f6 !important;
-        color: white !important;
-    }
-    
-    /* Alert boxes */
-    .stAlert {
-        border-radius: 8px;
-    }
-</style>
-""", unsafe_allow_html=True)
+@st.cache_resource
+def load_css():
+    """Read the stylesheet once per process"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles.css")) as f:
+        return f.read()
+
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # DATABASE INITIALIZATION
@@ -185,18 +55,162 @@ DB_PATH = "gtm_dashboard.db"
 
 @st.cache_resource
 def init_db():
+    """Create or migrate the schema once per process (errors propagate and are not cached)"""
     init_database(DB_PATH)
-    return True
-
-init_db()
 
 def get_db():
-    return get_connection(DB_PATH)
+    """Check out a pooled SQLite connection for a with-block, once the schema is ready"""
+    init_db()
+    return pooled_connection(DB_PATH)
+
+def get_db_token():
+    """Cache key for query results - changes whenever the database or its WAL is written"""
+    wal_path = DB_PATH + "-wal"
+    mtime = os.path.getmtime(DB_PATH)
+    if os.path.exists(wal_path):
+        mtime = max(mtime, os.path.getmtime(wal_path))
+    return mtime
+
+def invalidate_cache():
+    """Drop cached query results after a write"""
+    st.cache_data.clear()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CACHED QUERIES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@st.cache_data(ttl=60)
+def load_agreement(db_token, agreement_id):
+    """One agreement's full record (including notes and other free text), cached per database state"""
+    with get_db() as db:
+        return get_agreement(db, agreement_id)
+
+@st.cache_data(ttl=60)
+def load_agreements_df(db_token):
+    """Agreements as a DataFrame read straight from SQL"""
+    with get_db() as db:
+        cursor = db.cursor()
+        cursor.row_factory = None
+        cursor.execute(AGREEMENTS_WITH_POS_TOTAL_SQL + AGREEMENTS_ORDER_SQL)
+        df = pd.DataFrame.from_records(cursor.fetchall(), columns=[d[0] for d in cursor.description],
+                                       coerce_float=True)
+    return add_calculated_columns(df)
+
+@st.cache_data(ttl=60)
+def load_agreement_records(db_token):
+    """Rows of load_agreements_df as plain dicts (missing values as None), in the same order"""
+    df = load_agreements_df(db_token)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+@st.cache_data(ttl=60)
+def load_export_csv(db_token, table):
+    """CSV export bytes for 'agreements' or 'pos', built once per database state"""
+    export = export_agreements_csv if table == 'agreements' else export_pos_csv
+    with get_db() as db:
+        return export(db).encode('utf-8')
+
+@st.cache_data(ttl=60)
+def load_filter_options(db_token):
+    """Sorted distinct values for each sidebar filter"""
+    df = load_agreements_df(db_token)
+    columns = ['status', 'account_manager', 'region', 'customer_segment']
+    if df.empty:
+        return {col: [] for col in columns}
+    return {col: sorted(v for v in df[col].dropna().unique().tolist() if v) for col in columns}
+
+@st.cache_data(ttl=60)
+def load_kpi_summary(db_token):
+    """Headline KPIs aggregated in SQL"""
+    with get_db() as db:
+        return get_kpi_summary(db)
+
+@st.cache_data(ttl=60)
+def load_stats(db_token):
+    """All dashboard statistics, aggregated in SQL"""
+    with get_db() as db:
+        return {
+            'pipeline': get_pipeline_stats(db),
+            'monetization': get_monetization_stats(db),
+            'account_managers': get_account_manager_stats(db),
+            'aging_risk': get_aging_risk_matrix(db),
+            'forecast': get_forecast_data(db),
+        }
+
+@st.cache_data(ttl=60)
+def load_filtered_df(db_token, filters):
+    """Agreements matching the sidebar filters; filters is a tuple of (column, selected values) pairs"""
+    df = load_agreements_df(db_token)
+    if df.empty:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for column, values in filters:
+        if values:
+            mask &= df[column].isin(values).to_numpy()
+    return df[mask]
+
+@st.cache_data(ttl=60)
+def load_status_ids(db_token, filters, statuses):
+    """IDs of the filtered agreements whose status is in statuses, from one np.isin mask"""
+    df = load_filtered_df(db_token, filters)
+    if df.empty:
+        return []
+    return df['agreement_id'].to_numpy()[np.isin(df['status'].to_numpy(), list(statuses))].tolist()
+
+
+@st.cache_data(ttl=60)
+def build_pipeline_df(db_token, filters):
+    """Pre-signature rows of the filtered agreements"""
+    df = load_filtered_df(db_token, filters)
+    return df[df['status'].isin(PRE_SIGNATURE_VALUES)] if not df.empty else df
+
+@st.cache_data(ttl=60)
+def build_agreements_display_df(db_token, filters):
+    """Filtered agreements formatted for the All Agreements table"""
+    df = load_filtered_df(db_token, filters)
+    if df.empty:
+        return None
+    return pd.DataFrame({
+        'ID': df['agreement_id'],
+        'Agreement': df['agreement_name'],
+        'Customer': df['customer_name'],
+        'Segment': df['customer_segment'],
+        'Status': df['status'],
+        'Ceiling': format_currency_series(df['agreement_value_ceiling'], df['currency']),
+        'AM': df['account_manager'],
+        'Utilization': df['utilization_percent'],
+        'Risk': df['risk_flag'],
+    })
+
+@st.cache_data(ttl=60)
+def build_pos_display_df(db_token):
+    """All POs formatted for the All POs table"""
+    with get_db() as db:
+        all_pos = get_all_pos(db)
+    if not all_pos:
+        return None
+    df = pd.DataFrame(all_pos)
+    return pd.DataFrame({
+        'PO ID': df['po_id'],
+        'Agreement': df['agreement_id'],
+        'PO Number': df['po_number'],
+        'Date': df['po_date'],
+        'Value': format_currency_series(df['po_value'], df['currency']),
+        'Customer': df['customer_name'],
+        'AM': df['account_manager'],
+    })
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # HELPER FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════════
 
+# Widget option lists, built once at import instead of on every rerun
+CURRENCY_VALUES = tuple(c.value for c in Currency)
+CURRENCY_INDEX = {value: i for i, value in enumerate(CURRENCY_VALUES)}
+CUSTOMER_SEGMENT_VALUES = tuple(s.value for s in CustomerSegment)
+AGREEMENT_TYPE_VALUES = tuple(t.value for t in AgreementType)
+INITIAL_STATUS_VALUES = tuple(s.value for s in AgreementStatus if s in PRE_SIGNATURE_STATUSES)
+REGION_VALUES = ("Central", "Western", "Eastern", "Northern", "Southern")
+
 def format_currency(value, currency="SAR"):
     """Format currency value"""
     if value is None:
@@ -209,6 +223,96 @@ def format_percentage(value):
         return "-"
     return f"{value:.1f}%"
 
+def format_currency_series(values, currency="SAR"):
+    """Vectorized format_currency over a Series; currency is a code or a Series of codes"""
+    values = pd.to_numeric(values, errors='coerce')
+    if isinstance(currency, pd.Series):
+        currency = currency.fillna("SAR")
+    formatted = values.map('{:,.0f}'.format) + ' ' + currency
+    return formatted.where(values.notna(), "-")
+
+def sar_column(label):
+    """Numeric SAR table column with thousands separators, formatted by the frontend so it stays sortable"""
+    return st.column_config.NumberColumn(f"{label} (SAR)", format="accounting")
+
+def percent_column():
+    """Numeric percentage table column"""
+    return st.column_config.NumberColumn(format="%.1f%%")
+
+def utilization_column():
+    """Utilization percentage rendered as a progress bar"""
+    return st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.1f%%")
+
+# Above this many points, charts switch from SVG bars to WebGL markers
+WEBGL_POINT_THRESHOLD = 500
+
+# Traces longer than this are thinned with LTTB before being sent to the browser
+LTTB_THRESHOLD = 2000
+MAX_TREND_POINTS = 500
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of n_out points keeping the visual shape of y over sorted x"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        keep[i + 1] = a
+    return keep
+
+def maybe_downsample(records, key, n=50):
+    """Rank records by key (descending) and keep the top n so charts stay readable and fast to render"""
+    return sorted(records, key=lambda r: r[key] or 0, reverse=True)[:n]
+
+# RISK_FLAG_TABLE flattened in key order, so a packed (signed, day class, no POs, low use) index picks the flag
+RISK_FLAG_ARRAY = np.array([RISK_FLAG_TABLE[key] for key in sorted(RISK_FLAG_TABLE)], dtype=object)
+AGING_BUCKET_LABEL_ARRAY = np.array(AGING_BUCKET_LABELS, dtype=object)
+
+def add_calculated_columns(df):
+    """Column-wise add_calculated_fields for a frame of agreements with a total_pos_sar column"""
+    total = df.pop('total_pos_sar').to_numpy(dtype=float)
+    ceiling = df['ceiling_sar'].to_numpy(dtype=float)
+    days = (pd.Timestamp(date.today()) - pd.to_datetime(df['signed_date'], format='%Y-%m-%d')).dt.days
+    days_values = days.to_numpy(dtype=float)
+    
+    utilization = np.zeros(len(df))
+    np.divide(total, ceiling, out=utilization, where=ceiling > 0)
+    utilization *= 100
+    
+    dated = ~np.isnan(days_values)
+    
+    # Same rules as add_calculated_fields: searchsorted(side='right') is its bisect_right,
+    # and the RISK_FLAG_TABLE key tuple is packed into one index per row
+    bucket = np.searchsorted(AGING_BUCKET_EDGES, days_values, side='right')
+    day_class = np.searchsorted(RISK_DAY_EDGES, days_values, side='right')
+    risk_key = ((df['status'].isin(POST_SIGNATURE_VALUES).to_numpy() * (len(RISK_DAY_EDGES) + 1)
+                 + day_class) * 2 + (total == 0)) * 2 + (utilization < 10)
+    
+    df['total_pos_value_to_date'] = total
+    df['is_monetizing'] = total > 0
+    df['utilization_percent'] = utilization
+    df['days_since_signature'] = days.astype('Int64')
+    df['aging_bucket'] = np.where(dated, AGING_BUCKET_LABEL_ARRAY[bucket.clip(max=len(AGING_BUCKET_LABELS) - 1)], None)
+    df['risk_flag'] = np.where(dated, RISK_FLAG_ARRAY[np.where(dated, risk_key, 0)], RiskFlag.GREEN.value)
+    return df
+
+def truncate_labels(names, width):
+    """Shorten names longer than width to their first width characters plus '...', in one array pass"""
+    names = np.asarray(names, dtype=str)
+    return np.where(np.char.str_len(names) > width, np.char.add(names.astype(f'U{width}'), '...'), names)
+
 def get_risk_badge(risk):
     """Get HTML badge for risk flag"""
     colors = {
@@ -232,6 +336,158 @@ def get_status_color(status):
     }
     return colors.get(status, "#6b7280")
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# CHART BUILDERS
+# ═══════════════════════════════════════════════════════════════════════════════
+# Figures are cached by their (hashable) inputs so reruns with unchanged data
+# skip Plotly's trace construction.
+
+# Shared dark theme for the cartesian charts; uirevision keeps zoom/pan across reruns
+LAYOUT_DARK = dict(
+    height=400,
+    margin=dict(t=20, b=40),
+    paper_bgcolor='rgba(0,0,0,0)',
+    plot_bgcolor='rgba(0,0,0,0)',
+    font=dict(color='#e2e8f0'),
+    uirevision='constant'
+)
+AXIS_DARK = dict(gridcolor='#334155')
+
+@st.cache_data
+def build_overview_charts(status_counts, risk_counts):
+    """Status donut and risk bar side by side in one figure; counts are tuples of (label, count)"""
+    fig = make_subplots(
+        rows=1, cols=2,
+        specs=[[{'type': 'domain'}, {'type': 'xy'}]],
+        subplot_titles=("📊 Agreements by Status", "🎯 Risk Distribution")
+    )
+    
+    labels = [status for status, _ in status_counts]
+    fig.add_trace(go.Pie(
+        labels=labels,
+        values=[count for _, count in status_counts],
+        hole=0.4,
+        marker_colors=[get_status_color(s) for s in labels],
+        textinfo='label+value',
+        textposition='outside'
+    ), row=1, col=1)
+    
+    risk_values = [count for _, count in risk_counts]
+    fig.add_trace(go.Bar(
+        x=[risk for risk, _ in risk_counts],
+        y=risk_values,
+        marker_color=['#10b981', '#f59e0b', '#ef4444'],
+        text=risk_values,
+        textposition='auto',
+        showlegend=False
+    ), row=1, col=2)
+    
+    fig.update_xaxes(title_text="Risk Level", gridcolor='#334155', row=1, col=2)
+    fig.update_yaxes(title_text="Count", gridcolor='#334155', row=1, col=2)
+    fig.update_layout(
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=-0.2),
+        height=400,
+        margin=dict(t=40, b=80),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='#e2e8f0')
+    )
+    return fig
+
+@st.cache_data
+def build_pipeline_funnel(stage_counts):
+    """Funnel of pre-signature stages; stage_counts is a tuple of (stage, count)"""
+    fig = go.Figure(go.Funnel(
+        y=[stage for stage, _ in stage_counts],
+        x=[count for _, count in stage_counts],
+        textinfo="value+percent initial",
+        marker_color=['#6366f1', '#8b5cf6', '#ec4899', '#f97316']
+    ))
+    fig.update_layout(
+        height=350,
+        margin=dict(t=20, b=20),
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='#e2e8f0')
+    )
+    return fig
+
+@st.cache_data
+def build_aging_heatmap(matrix_df):
+    """Aging bucket vs risk flag heatmap; matrix_df has buckets as rows and risks as columns"""
+    z_data = matrix_df.to_numpy()
+    fig = go.Figure(data=go.Heatmap(
+        z=z_data,
+        x=list(matrix_df.columns),
+        y=list(matrix_df.index),
+        colorscale=[[0, '#1e293b'], [0.5, '#f59e0b'], [1, '#ef4444']],
+        text=z_data,
+        texttemplate='%{text}',
+        textfont={"size": 16},
+        hoverongaps=False
+    ))
+    fig.update_layout(
+        xaxis_title="Risk Level",
+        yaxis_title="Days Since Signature",
+        height=350,
+        margin=dict(t=20, b=40),
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='#e2e8f0')
+    )
+    return fig
+
+@st.cache_data
+def build_pipeline_scatter(scatter_df):
+    """Pipeline probability vs SAR value scatter, bubbles sized by weighted value"""
+    fig = px.scatter(
+        scatter_df, x='Probability', y='Value', size='Weighted',
+        hover_name='Agreement',
+        color='Probability',
+        color_continuous_scale='Viridis',
+        render_mode='auto'
+    )
+    fig.update_layout(
+        LAYOUT_DARK,
+        xaxis={**AXIS_DARK, 'title': 'Probability (%)'},
+        yaxis={**AXIS_DARK, 'title': 'Value (SAR)'}
+    )
+    return fig
+
+@st.cache_data
+def build_monthly_po_trend(months, values):
+    """Monthly PO bars with a least-squares trend line; months and values are parallel tuples"""
+    xs = np.arange(len(values), dtype=np.float64)
+    ys = np.asarray(values, dtype=np.float64)
+    keep = lttb_indices(xs, ys, MAX_TREND_POINTS)
+    shown_months = [months[i] for i in keep]
+    
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=shown_months, y=ys[keep],
+        marker_color='#3b82f6',
+        name='PO Value'
+    ))
+    
+    # Add trend line, fitted on every month even when the bars are thinned
+    if len(values) > 1:
+        # Closed-form least-squares line; no LAPACK call for a degree-1 fit
+        dx = xs - xs.mean()
+        slope = (dx * (ys - ys.mean())).sum() / (dx ** 2).sum()
+        intercept = ys.mean() - slope * xs.mean()
+        fig.add_trace(go.Scatter(
+            x=shown_months, y=(slope * xs[keep] + intercept).tolist(),
+            mode='lines',
+            line=dict(color='#f59e0b', width=2, dash='dash'),
+            name='Trend'
+        ))
+    
+    fig.update_layout(
+        LAYOUT_DARK,
+        xaxis={**AXIS_DARK, 'title': 'Month'},
+        yaxis={**AXIS_DARK, 'title': 'PO Value (SAR)'}
+    )
+    return fig
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # SIDEBAR NAVIGATION
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -267,160 +523,115 @@ st.sidebar.markdown("---")
 # Global Filters
 st.sidebar.markdown("### 🔍 Filters")
 
-conn = get_db()
-all_agreements = get_all_agreements(conn)
+init_db()
+db_token = get_db_token()
+all_agreements = load_agreement_records(db_token)
+agreements_by_id = {a['agreement_id']: a for a in all_agreements}
+
+def agreements_for_ids(agreement_ids):
+    """Agreement dicts for the given IDs, in that order (IDs missing from the list are skipped)"""
+    return [agreements_by_id[i] for i in agreement_ids if i in agreements_by_id]
 
 # Get unique values for filters
-all_statuses = list(set(a['status'] for a in all_agreements)) if all_agreements else []
-all_ams = list(set(a['account_manager'] for a in all_agreements if a['account_manager'])) if all_agreements else []
-all_regions = list(set(a['region'] for a in all_agreements if a['region'])) if all_agreements else []
-all_segments = list(set(a['customer_segment'] for a in all_agreements if a['customer_segment'])) if all_agreements else []
+filter_options = load_filter_options(db_token)
 
-filter_status = st.sidebar.multiselect("Status", all_statuses)
-filter_am = st.sidebar.multiselect("Account Manager", all_ams)
-filter_region = st.sidebar.multiselect("Region", all_regions)
-filter_segment = st.sidebar.multiselect("Customer Segment", all_segments)
+filter_status = st.sidebar.multiselect("Status", filter_options['status'])
+filter_am = st.sidebar.multiselect("Account Manager", filter_options['account_manager'])
+filter_region = st.sidebar.multiselect("Region", filter_options['region'])
+filter_segment = st.sidebar.multiselect("Customer Segment", filter_options['customer_segment'])
 
 # Apply filters
-def apply_filters(agreements):
-    filtered = agreements
-    if filter_status:
-        filtered = [a for a in filtered if a['status'] in filter_status]
-    if filter_am:
-        filtered = [a for a in filtered if a['account_manager'] in filter_am]
-    if filter_region:
-        filtered = [a for a in filtered if a['region'] in filter_region]
-    if filter_segment:
-        filtered = [a for a in filtered if a['customer_segment'] in filter_segment]
-    return filtered
-
-filtered_agreements = apply_filters(all_agreements)
+filter_key = (
+    ('status', tuple(filter_status)),
+    ('account_manager', tuple(filter_am)),
+    ('region', tuple(filter_region)),
+    ('customer_segment', tuple(filter_segment)),
+)
+agreements_df = load_agreements_df(db_token)
+filtered_df = load_filtered_df(db_token, filter_key)
+filtered_agreements = agreements_for_ids(filtered_df['agreement_id'] if not filtered_df.empty else [])
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: OVERVIEW
 # ═══════════════════════════════════════════════════════════════════════════════
 
-if page == "🏠 Overview":
+def render_overview():
+    """Overview page: headline KPIs, status and risk charts, recent agreements"""
+    stats = load_stats(db_token)
+    
     st.markdown("## 🏠 Dashboard Overview")
     st.markdown("Real-time visibility into your framework agreements pipeline and monetization performance.")
     
     # Key Metrics Row
     col1, col2, col3, col4, col5 = st.columns(5)
     
-    pipeline_stats = get_pipeline_stats(conn)
-    monetization_stats = get_monetization_stats(conn)
+    kpis = load_kpi_summary(db_token)
     
     with col1:
         st.metric(
             "Total Agreements",
-            len(all_agreements),
+            kpis['total_agreements'],
             help="Total number of agreements in the system"
         )
     
     with col2:
         st.metric(
             "Pipeline Value",
-            format_currency(pipeline_stats['total_potential_ceiling']),
+            format_currency(kpis['pipeline_ceiling']),
             help="Total ceiling value of pre-signature agreements"
         )
     
     with col3:
         st.metric(
             "Signed Value",
-            format_currency(monetization_stats['total_signed_ceiling']),
+            format_currency(kpis['signed_ceiling']),
             help="Total ceiling value of signed/active agreements"
         )
     
     with col4:
         st.metric(
             "Monetized",
-            format_currency(monetization_stats['total_monetized_value']),
+            format_currency(kpis['monetized_value']),
             help="Total value of POs against signed agreements"
         )
     
     with col5:
         st.metric(
             "Utilization",
-            format_percentage(monetization_stats['overall_utilization']),
+            format_percentage(kpis['overall_utilization']),
             help="Overall monetization vs ceiling"
         )
     
     st.markdown("---")
     
-    # Two column layout for charts
-    col1, col2 = st.columns(2)
+    # Status and risk charts share one figure
+    status_counts = agreements_df['status'].value_counts() if not agreements_df.empty else pd.Series(dtype=int)
+    risk_counts = stats['monetization']['by_risk']
     
-    with col1:
-        st.markdown("### 📊 Agreements by Status")
-        
-        status_counts = {}
-        for a in all_agreements:
-            status = a['status']
-            status_counts[status] = status_counts.get(status, 0) + 1
-        
-        if status_counts:
-            fig = go.Figure(data=[go.Pie(
-                labels=list(status_counts.keys()),
-                values=list(status_counts.values()),
-                hole=0.4,
-                marker_colors=[get_status_color(s) for s in status_counts.keys()],
-                textinfo='label+value',
-                textposition='outside'
-            )])
-            fig.update_layout(
-                showlegend=True,
-                legend=dict(orientation="h", yanchor="bottom", y=-0.2),
-                height=400,
-                margin=dict(t=20, b=80),
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0')
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("No agreements to display")
-    
-    with col2:
-        st.markdown("### 🎯 Risk Distribution")
-        
-        risk_counts = monetization_stats['by_risk']
-        
-        fig = go.Figure(data=[go.Bar(
-            x=list(risk_counts.keys()),
-            y=list(risk_counts.values()),
-            marker_color=['#10b981', '#f59e0b', '#ef4444'],
-            text=list(risk_counts.values()),
-            textposition='auto'
-        )])
-        fig.update_layout(
-            xaxis_title="Risk Level",
-            yaxis_title="Count",
-            height=400,
-            margin=dict(t=20, b=40),
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='#e2e8f0'),
-            xaxis=dict(gridcolor='#334155'),
-            yaxis=dict(gridcolor='#334155')
-        )
+    if not status_counts.empty:
+        fig = build_overview_charts(tuple(status_counts.items()), tuple(risk_counts.items()))
         st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No agreements to display")
     
     # Recent Activity Table
     st.markdown("### 📋 Recent Agreements")
     
     if filtered_agreements:
-        recent_df = pd.DataFrame(filtered_agreements[:10])
         display_cols = ['agreement_id', 'agreement_name', 'customer_name', 'status', 
                        'agreement_value_ceiling', 'currency', 'utilization_percent', 'risk_flag']
         
-        if all(col in recent_df.columns for col in display_cols):
-            display_df = recent_df[display_cols].copy()
-            display_df['agreement_value_ceiling'] = display_df.apply(
-                lambda x: format_currency(x['agreement_value_ceiling'], x['currency']), axis=1
-            )
-            display_df['utilization_percent'] = display_df['utilization_percent'].apply(format_percentage)
-            display_df.columns = ['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'Currency', 'Utilization', 'Risk']
-            st.dataframe(display_df.drop(columns=['Currency']), use_container_width=True, hide_index=True)
+        # Project the needed columns before building the frame
+        display_df = pd.DataFrame(
+            [{col: a.get(col) for col in display_cols} for a in filtered_agreements[:10]],
+            columns=display_cols
+        )
+        display_df['agreement_value_ceiling'] = format_currency_series(
+            display_df['agreement_value_ceiling'], display_df['currency']
+        )
+        display_df.columns = ['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'Currency', 'Utilization', 'Risk']
+        st.dataframe(display_df.drop(columns=['Currency']), use_container_width=True, hide_index=True,
+                     column_config={'Utilization': utilization_column()})
     else:
         st.info("No agreements found. Add some agreements to get started!")
 
@@ -428,11 +639,14 @@ if page == "🏠 Overview":
 # PAGE: PIPELINE
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "📈 Pipeline":
+def render_pipeline():
+    """Pipeline page: pre-signature KPIs, funnel and pipeline table"""
+    stats = load_stats(db_token)
+    
     st.markdown("## 📈 Pipeline Overview")
     st.markdown("Track pre-signature agreements through the sales cycle.")
     
-    pipeline_stats = get_pipeline_stats(conn)
+    pipeline_stats = stats['pipeline']
     
     # Pipeline KPIs
     col1, col2, col3, col4 = st.columns(4)
@@ -460,18 +674,7 @@ elif page == "📈 Pipeline":
             funnel_data.append({"Stage": status.value, "Count": count})
         
         if any(d['Count'] > 0 for d in funnel_data):
-            fig = go.Figure(go.Funnel(
-                y=[d['Stage'] for d in funnel_data],
-                x=[d['Count'] for d in funnel_data],
-                textinfo="value+percent initial",
-                marker_color=['#6366f1', '#8b5cf6', '#ec4899', '#f97316']
-            ))
-            fig.update_layout(
-                height=350,
-                margin=dict(t=20, b=20),
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0')
-            )
+            fig = build_pipeline_funnel(tuple((d['Stage'], d['Count']) for d in funnel_data))
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No pipeline agreements to display")
@@ -485,24 +688,16 @@ elif page == "📈 Pipeline":
     # Pipeline Table
     st.markdown("### 📋 Pipeline Agreements")
     
-    pipeline_agreements = [a for a in filtered_agreements 
-                         if a['status'] in [s.value for s in PRE_SIGNATURE_STATUSES]]
+    df = build_pipeline_df(db_token, filter_key)
     
-    if pipeline_agreements:
-        df = pd.DataFrame(pipeline_agreements)
+    if not df.empty:
         display_cols = ['agreement_id', 'agreement_name', 'customer_name', 'status',
-                       'agreement_value_ceiling', 'probability_to_sign', 'expected_signature_date', 'account_manager']
+                       'ceiling_sar', 'probability_to_sign', 'expected_signature_date', 'account_manager']
         
         if all(col in df.columns for col in display_cols):
-            display_df = df[display_cols].copy()
-            display_df['agreement_value_ceiling'] = display_df['agreement_value_ceiling'].apply(
-                lambda x: format_currency(x) if x else "-"
-            )
-            display_df['probability_to_sign'] = display_df['probability_to_sign'].apply(
-                lambda x: format_percentage(x) if x else "-"
-            )
-            display_df.columns = ['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'Probability', 'Expected Sign', 'AM']
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
+            display_df = df[display_cols].set_axis(['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'Probability', 'Expected Sign', 'AM'], axis=1)
+            st.dataframe(display_df, use_container_width=True, hide_index=True,
+                         column_config={'Ceiling': sar_column('Ceiling'), 'Probability': percent_column()})
     else:
         st.info("No pipeline agreements found")
 
@@ -510,11 +705,14 @@ elif page == "📈 Pipeline":
 # PAGE: MONETIZATION
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "💰 Monetization":
+def render_monetization():
+    """Monetization page: signed agreement KPIs, utilization charts and detail table"""
+    stats = load_stats(db_token)
+    
     st.markdown("## 💰 Signed & Monetization")
     st.markdown("Track monetization performance of signed and active agreements.")
     
-    monetization_stats = get_monetization_stats(conn)
+    monetization_stats = stats['monetization']
     
     # Monetization KPIs
     col1, col2, col3, col4 = st.columns(4)
@@ -533,35 +731,41 @@ elif page == "💰 Monetization":
     # Charts
     col1, col2 = st.columns(2)
     
-    signed_agreements = [a for a in filtered_agreements 
-                        if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]]
+    signed_agreements = agreements_for_ids(load_status_ids(db_token, filter_key, POST_SIGNATURE_VALUES))
     
     with col1:
         st.markdown("### 📊 Utilization by Agreement")
         
         if signed_agreements:
-            util_data = [{
-                'Agreement': a['agreement_name'][:30] + '...' if len(a['agreement_name']) > 30 else a['agreement_name'],
-                'Utilization': a['utilization_percent'],
-                'Risk': a['risk_flag']
-            } for a in signed_agreements]
+            risk_colors = {'Green': '#10b981', 'Amber': '#f59e0b', 'Red': '#ef4444'}
+            use_webgl = len(signed_agreements) > WEBGL_POINT_THRESHOLD
             
-            df = pd.DataFrame(util_data)
+            shown = maybe_downsample(signed_agreements, 'utilization_percent', n=None if use_webgl else 50)
+            df = pd.DataFrame({
+                'Agreement': truncate_labels([a['agreement_name'] for a in shown], 30),
+                'Utilization': [a['utilization_percent'] for a in shown],
+                'Risk': [a['risk_flag'] for a in shown]
+            })
             
-            fig = px.bar(
-                df, x='Agreement', y='Utilization',
-                color='Risk',
-                color_discrete_map={'Green': '#10b981', 'Amber': '#f59e0b', 'Red': '#ef4444'}
-            )
+            if use_webgl:
+                fig = go.Figure(go.Scattergl(
+                    x=df['Agreement'], y=df['Utilization'],
+                    mode='markers',
+                    marker_color=df['Risk'].map(risk_colors),
+                    text=df['Risk']
+                ))
+            else:
+                fig = px.bar(
+                    df, x='Agreement', y='Utilization',
+                    color='Risk',
+                    color_discrete_map=risk_colors
+                )
             fig.update_layout(
+                LAYOUT_DARK,
                 xaxis_tickangle=-45,
-                height=400,
                 margin=dict(t=20, b=100),
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0'),
-                xaxis=dict(gridcolor='#334155'),
-                yaxis=dict(gridcolor='#334155', title='Utilization %')
+                xaxis=AXIS_DARK,
+                yaxis={**AXIS_DARK, 'title': 'Utilization %'}
             )
             st.plotly_chart(fig, use_container_width=True)
         else:
@@ -570,7 +774,7 @@ elif page == "💰 Monetization":
     with col2:
         st.markdown("### 👤 Utilization by Account Manager")
         
-        am_stats = get_account_manager_stats(conn)
+        am_stats = stats['account_managers']
         
         if am_stats:
             am_data = [{
@@ -587,15 +791,12 @@ elif page == "💰 Monetization":
                     go.Bar(name='Monetized', x=df['AM'], y=df['Monetized'], marker_color='#10b981')
                 ])
                 fig.update_layout(
+                    LAYOUT_DARK,
                     barmode='group',
                     xaxis_tickangle=-45,
-                    height=400,
                     margin=dict(t=20, b=100),
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#e2e8f0'),
-                    xaxis=dict(gridcolor='#334155'),
-                    yaxis=dict(gridcolor='#334155', title='Value (SAR)')
+                    xaxis=AXIS_DARK,
+                    yaxis={**AXIS_DARK, 'title': 'Value (SAR)'}
                 )
                 st.plotly_chart(fig, use_container_width=True)
             else:
@@ -609,20 +810,14 @@ elif page == "💰 Monetization":
     if signed_agreements:
         df = pd.DataFrame(signed_agreements)
         display_cols = ['agreement_id', 'agreement_name', 'customer_name', 'status',
-                       'agreement_value_ceiling', 'total_pos_value_to_date', 'utilization_percent',
+                       'ceiling_sar', 'total_pos_value_to_date', 'utilization_percent',
                        'days_since_signature', 'risk_flag']
         
         if all(col in df.columns for col in display_cols):
-            display_df = df[display_cols].copy()
-            display_df['agreement_value_ceiling'] = display_df['agreement_value_ceiling'].apply(
-                lambda x: format_currency(x) if x else "-"
-            )
-            display_df['total_pos_value_to_date'] = display_df['total_pos_value_to_date'].apply(
-                lambda x: format_currency(x) if x else "-"
-            )
-            display_df['utilization_percent'] = display_df['utilization_percent'].apply(format_percentage)
-            display_df.columns = ['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'POs Value', 'Utilization', 'Days Since Sign', 'Risk']
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
+            display_df = df[display_cols].set_axis(['ID', 'Agreement', 'Customer', 'Status', 'Ceiling', 'POs Value', 'Utilization', 'Days Since Sign', 'Risk'], axis=1)
+            st.dataframe(display_df, use_container_width=True, hide_index=True,
+                         column_config={'Ceiling': sar_column('Ceiling'), 'POs Value': sar_column('POs Value'),
+                                        'Utilization': utilization_column()})
     else:
         st.info("No signed agreements found")
 
@@ -630,25 +825,27 @@ elif page == "💰 Monetization":
 # PAGE: ACCOUNT MANAGERS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "👤 Account Managers":
+def render_account_managers():
+    """Account Managers page: leaderboard and per-AM charts"""
+    stats = load_stats(db_token)
+    
     st.markdown("## 👤 Account Manager Performance")
     st.markdown("Track individual performance metrics by account manager.")
     
-    am_stats = get_account_manager_stats(conn)
+    am_stats = stats['account_managers']
     
     if am_stats:
         # Leaderboard
         st.markdown("### 🏆 Leaderboard")
         
         df = pd.DataFrame(am_stats)
-        df['signed_value'] = df['signed_value'].apply(format_currency)
-        df['monetized_value'] = df['monetized_value'].apply(format_currency)
-        df['utilization'] = df['utilization'].apply(format_percentage)
-        
         df.columns = ['Account Manager', 'Total Agreements', 'Signed', 'Signed Value', 
                      'Monetized Value', 'Utilization', 'Avg Time to Sign']
         
-        st.dataframe(df.drop(columns=['Avg Time to Sign']), use_container_width=True, hide_index=True)
+        st.dataframe(df.drop(columns=['Avg Time to Sign']), use_container_width=True, hide_index=True,
+                     column_config={'Signed Value': sar_column('Signed Value'),
+                                    'Monetized Value': sar_column('Monetized Value'),
+                                    'Utilization': utilization_column()})
         
         st.markdown("---")
         
@@ -658,7 +855,7 @@ elif page == "👤 Account Managers":
         with col1:
             st.markdown("### 📊 Agreements by AM")
             
-            am_data = get_account_manager_stats(conn)
+            am_data = am_stats
             fig = px.bar(
                 x=[a['account_manager'] for a in am_data],
                 y=[a['total_agreements'] for a in am_data],
@@ -678,19 +875,24 @@ elif page == "👤 Account Managers":
         with col2:
             st.markdown("### 💰 Monetization by AM")
             
-            fig = go.Figure(data=[go.Pie(
-                labels=[a['account_manager'] for a in am_data if a['monetized_value'] > 0],
-                values=[a['monetized_value'] for a in am_data if a['monetized_value'] > 0],
-                hole=0.4,
-                textinfo='label+percent'
-            )])
-            fig.update_layout(
-                height=350,
-                margin=dict(t=20, b=20),
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0')
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            monetizing_ams = [a for a in am_data if a['monetized_value'] > 0]
+            
+            if monetizing_ams:
+                fig = go.Figure(data=[go.Pie(
+                    labels=[a['account_manager'] for a in monetizing_ams],
+                    values=[a['monetized_value'] for a in monetizing_ams],
+                    hole=0.4,
+                    textinfo='label+percent'
+                )])
+                fig.update_layout(
+                    height=350,
+                    margin=dict(t=20, b=20),
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(color='#e2e8f0')
+                )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No monetization data available")
     else:
         st.info("No account manager data available")
 
@@ -698,13 +900,15 @@ elif page == "👤 Account Managers":
 # PAGE: AGING & RISK
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "⚠️ Aging & Risk":
+def render_aging_risk():
+    """Aging & Risk page: risk summary, aging heatmap and risk alerts"""
+    stats = load_stats(db_token)
+    
     st.markdown("## ⚠️ Aging & Risk Analysis")
     st.markdown("Identify at-risk agreements requiring attention.")
     
     # Risk Summary
-    monetization_stats = get_monetization_stats(conn)
-    risk_counts = monetization_stats['by_risk']
+    risk_counts = stats['monetization']['by_risk']
     
     col1, col2, col3 = st.columns(3)
     
@@ -743,39 +947,21 @@ elif page == "⚠️ Aging & Risk":
     # Aging vs Risk Heatmap
     st.markdown("### 🗓️ Aging vs Risk Matrix")
     
-    matrix = get_aging_risk_matrix(conn)
+    matrix = stats['aging_risk']
     
     # Create heatmap data
     buckets = ['<30d', '30-60d', '61-90d', '>90d']
     risks = ['Green', 'Amber', 'Red']
     
-    z_data = [[matrix.get(bucket, {}).get(risk, 0) for risk in risks] for bucket in buckets]
+    matrix_df = pd.DataFrame(matrix).T.reindex(index=buckets, columns=risks, fill_value=0)
     
-    fig = go.Figure(data=go.Heatmap(
-        z=z_data,
-        x=risks,
-        y=buckets,
-        colorscale=[[0, '#1e293b'], [0.5, '#f59e0b'], [1, '#ef4444']],
-        text=z_data,
-        texttemplate='%{text}',
-        textfont={"size": 16},
-        hoverongaps=False
-    ))
-    fig.update_layout(
-        xaxis_title="Risk Level",
-        yaxis_title="Days Since Signature",
-        height=350,
-        margin=dict(t=20, b=40),
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='#e2e8f0')
-    )
+    fig = build_aging_heatmap(matrix_df)
     st.plotly_chart(fig, use_container_width=True)
     
     # Risk Alerts
     st.markdown("### 🚨 Risk Alerts")
     
-    signed_agreements = [a for a in filtered_agreements 
-                        if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]]
+    signed_agreements = agreements_for_ids(load_status_ids(db_token, filter_key, POST_SIGNATURE_VALUES))
     
     red_risks = [a for a in signed_agreements if a['risk_flag'] == 'Red']
     amber_risks = [a for a in signed_agreements if a['risk_flag'] == 'Amber']
@@ -814,13 +1000,16 @@ elif page == "⚠️ Aging & Risk":
 # PAGE: FORECAST
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "📊 Forecast":
+def render_forecast():
+    """Forecast page: weighted pipeline and monthly PO trend"""
+    stats = load_stats(db_token)
+    
     st.markdown("## 📊 Forecast & Projections")
     st.markdown("Pipeline forecast and monetization trends.")
     
-    forecast_data = get_forecast_data(conn)
-    pipeline_stats = get_pipeline_stats(conn)
-    monetization_stats = get_monetization_stats(conn)
+    forecast_data = stats['forecast']
+    pipeline_stats = stats['pipeline']
+    monetization_stats = stats['monetization']
     
     # Forecast KPIs
     col1, col2, col3 = st.columns(3)
@@ -846,38 +1035,22 @@ elif page == "📊 Forecast":
     with col1:
         st.markdown("### 📈 Pipeline by Probability")
         
-        pipeline_agreements = [a for a in filtered_agreements 
-                              if a['status'] in [s.value for s in PRE_SIGNATURE_STATUSES]]
+        pipeline_df = build_pipeline_df(db_token, filter_key)
         
-        if pipeline_agreements:
-            prob_data = []
-            for a in pipeline_agreements:
-                prob = a.get('probability_to_sign') or 0
-                ceiling = convert_to_sar(a['agreement_value_ceiling'], a['currency'])
-                prob_data.append({
-                    'Agreement': a['agreement_name'][:25] + '...' if len(a['agreement_name']) > 25 else a['agreement_name'],
-                    'Probability': prob,
-                    'Value': ceiling,
-                    'Weighted': ceiling * prob / 100
-                })
+        if not pipeline_df.empty:
+            probs = pipeline_df['probability_to_sign'].fillna(0).to_numpy(dtype=np.float64)
+            ceilings = pipeline_df['ceiling_sar'].to_numpy(dtype=np.float64)
+            df = pd.DataFrame({
+                'Agreement': truncate_labels(pipeline_df['agreement_name'], 25),
+                'Probability': probs,
+                'Value': ceilings,
+                'Weighted': ceilings * probs / 100
+            })
+            if len(df) > LTTB_THRESHOLD:
+                df = df.sort_values('Probability', kind='stable', ignore_index=True)
+                df = df.iloc[lttb_indices(df['Probability'], df['Value'], LTTB_THRESHOLD)]
             
-            df = pd.DataFrame(prob_data)
-            
-            fig = px.scatter(
-                df, x='Probability', y='Value', size='Weighted',
-                hover_name='Agreement',
-                color='Probability',
-                color_continuous_scale='Viridis'
-            )
-            fig.update_layout(
-                height=400,
-                margin=dict(t=20, b=40),
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0'),
-                xaxis=dict(gridcolor='#334155', title='Probability (%)'),
-                yaxis=dict(gridcolor='#334155', title='Value (SAR)')
-            )
+            fig = build_pipeline_scatter(df)
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No pipeline agreements to display")
@@ -889,37 +1062,7 @@ elif page == "📊 Forecast":
         
         if monthly_pos:
             months = sorted(monthly_pos.keys())
-            values = [monthly_pos[m] for m in months]
-            
-            fig = go.Figure()
-            fig.add_trace(go.Bar(
-                x=months, y=values,
-                marker_color='#3b82f6',
-                name='PO Value'
-            ))
-            
-            # Add trend line
-            if len(values) > 1:
-                import numpy as np
-                x_numeric = list(range(len(months)))
-                z = np.polyfit(x_numeric, values, 1)
-                p = np.poly1d(z)
-                fig.add_trace(go.Scatter(
-                    x=months, y=[p(x) for x in x_numeric],
-                    mode='lines',
-                    line=dict(color='#f59e0b', width=2, dash='dash'),
-                    name='Trend'
-                ))
-            
-            fig.update_layout(
-                height=400,
-                margin=dict(t=20, b=40),
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='#e2e8f0'),
-                xaxis=dict(gridcolor='#334155', title='Month'),
-                yaxis=dict(gridcolor='#334155', title='PO Value (SAR)')
-            )
+            fig = build_monthly_po_trend(tuple(months), tuple(monthly_pos[m] for m in months))
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No PO data to display")
@@ -928,7 +1071,172 @@ elif page == "📊 Forecast":
 # PAGE: AGREEMENTS MANAGEMENT
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "📝 Agreements":
+@st.fragment
+def render_create_agreement_tab():
+    """Create New tab; runs as a fragment so its widgets don't rerun the whole page"""
+    with st.form("create_agreement_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            agreement_name = st.text_input("Agreement Name*", placeholder="e.g., AI Services Framework")
+            customer_name = st.text_input("Customer Name*", placeholder="e.g., Ministry of Interior")
+            customer_segment = st.selectbox("Customer Segment*", CUSTOMER_SEGMENT_VALUES)
+            region = st.selectbox("Region", REGION_VALUES)
+            industry = st.text_input("Industry", placeholder="e.g., Public Sector")
+            agreement_type = st.selectbox("Agreement Type*", AGREEMENT_TYPE_VALUES)
+        
+        with col2:
+            agreement_value = st.number_input("Agreement Value Ceiling*", min_value=1.0, value=1000000.0)
+            currency = st.selectbox("Currency", CURRENCY_VALUES)
+            status = st.selectbox("Initial Status", INITIAL_STATUS_VALUES)
+            account_manager = st.text_input("Account Manager*", placeholder="e.g., Mohammed Al-Shehri")
+            sales_owner = st.text_input("Sales Owner", placeholder="e.g., Ahmed Al-Harbi")
+            probability = st.slider("Probability to Sign (%)", 0, 100, 50)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("Start Date", value=date.today())
+        with col2:
+            end_date = st.date_input("End Date", value=date.today() + timedelta(days=365))
+        
+        expected_sign = st.date_input("Expected Signature Date", value=date.today() + timedelta(days=30))
+        notes = st.text_area("Notes", placeholder="Additional details...")
+        
+        submitted = st.form_submit_button("Create Agreement", use_container_width=True)
+        
+        if submitted:
+            if not agreement_name or not customer_name or not account_manager:
+                st.error("Please fill in all required fields (*)")
+            else:
+                try:
+                    agreement_data = {
+                        "agreement_name": agreement_name,
+                        "customer_name": customer_name,
+                        "customer_segment": customer_segment,
+                        "region": region,
+                        "industry": industry,
+                        "agreement_type": agreement_type,
+                        "start_date": start_date.isoformat(),
+                        "end_date": end_date.isoformat(),
+                        "agreement_value_ceiling": agreement_value,
+                        "currency": currency,
+                        "status": status,
+                        "status_date": date.today().isoformat(),
+                        "account_manager": account_manager,
+                        "sales_owner": sales_owner,
+                        "probability_to_sign": probability,
+                        "expected_signature_date": expected_sign.isoformat(),
+                        "notes": notes,
+                    }
+                    
+                    with get_db() as conn, transaction(conn):
+                        agreement_id = create_agreement(conn, agreement_data)
+                    st.success(f"✅ Agreement created successfully! ID: {agreement_id}")
+                    invalidate_cache()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error creating agreement: {e}")
+
+@st.fragment
+def render_edit_agreement_tab(agreements_by_id):
+    """Edit/View tab; runs as a fragment so picking an agreement doesn't rerun the whole page"""
+    agreement_ids = list(agreements_by_id)
+    
+    if agreement_ids:
+        selected_id = st.selectbox("Select Agreement", agreement_ids)
+        
+        if selected_id:
+            # The list rows skip notes and other free text; the form needs the full record
+            agreement = load_agreement(db_token, selected_id)
+            
+            if agreement:
+                col1, col2, col3 = st.columns(3)
+                
+                with col1:
+                    st.metric("Status", agreement['status'])
+                with col2:
+                    st.metric("Utilization", format_percentage(agreement['utilization_percent']))
+                with col3:
+                    st.metric("Risk", agreement['risk_flag'])
+                
+                st.markdown("---")
+                
+                with st.form("edit_agreement_form"):
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        edit_name = st.text_input("Agreement Name", value=agreement['agreement_name'])
+                        edit_customer = st.text_input("Customer Name", value=agreement['customer_name'])
+                        
+                        current_status = AgreementStatus(agreement['status'])
+                        allowed_next = ALLOWED_STATUS_TRANSITIONS.get(current_status, [])
+                        status_options = [current_status.value] + [s.value for s in allowed_next]
+                        edit_status = st.selectbox("Status", status_options)
+                        
+                        edit_am = st.text_input("Account Manager", value=agreement['account_manager'] or "")
+                    
+                    with col2:
+                        edit_value = st.number_input("Value Ceiling", 
+                                                    value=float(agreement['agreement_value_ceiling']))
+                        edit_currency = st.selectbox("Currency", 
+                                                    CURRENCY_VALUES,
+                                                    index=CURRENCY_INDEX[agreement['currency']])
+                        
+                        edit_prob = None
+                        if edit_status in POST_SIGNATURE_VALUES:
+                            default_signed = date.fromisoformat(agreement['signed_date']) if agreement['signed_date'] else date.today()
+                            edit_signed_date = st.date_input("Signed Date", value=default_signed)
+                        else:
+                            edit_signed_date = None
+                            edit_prob = st.slider("Probability (%)", 0, 100, 
+                                                 int(agreement['probability_to_sign'] or 50))
+                    
+                    edit_notes = st.text_area("Notes", value=agreement['notes'] or "")
+                    
+                    update_submitted = st.form_submit_button("Update Agreement", use_container_width=True)
+                    
+                    if update_submitted:
+                        try:
+                            update_data = {
+                                "agreement_name": edit_name,
+                                "customer_name": edit_customer,
+                                "status": edit_status,
+                                "status_date": date.today().isoformat(),
+                                "account_manager": edit_am,
+                                "agreement_value_ceiling": edit_value,
+                                "currency": edit_currency,
+                                "notes": edit_notes,
+                            }
+                            
+                            if edit_signed_date:
+                                update_data["signed_date"] = edit_signed_date.isoformat()
+                            elif edit_prob is not None:
+                                update_data["probability_to_sign"] = edit_prob
+                            
+                            with get_db() as conn, transaction(conn):
+                                update_agreement(conn, selected_id, update_data)
+                            st.success("✅ Agreement updated successfully!")
+                            invalidate_cache()
+                            st.rerun()
+                        except ValueError as e:
+                            st.error(f"Error: {e}")
+                        except Exception as e:
+                            st.error(f"Error updating agreement: {e}")
+                
+                # Delete button
+                st.markdown("---")
+                if st.button("🗑️ Delete Agreement", type="secondary"):
+                    with get_db() as conn, transaction(conn):
+                        deleted = delete_agreement(conn, selected_id)
+                    if deleted:
+                        st.success("Agreement deleted!")
+                        invalidate_cache()
+                        st.rerun()
+    else:
+        st.info("No agreements to edit")
+
+def render_agreements():
+    """Agreements page: list, create and edit agreements"""
     st.markdown("## 📝 Agreement Management")
     
     tab1, tab2, tab3 = st.tabs(["📋 All Agreements", "➕ Create New", "✏️ Edit/View"])
@@ -936,185 +1244,96 @@ elif page == "📝 Agreements":
     with tab1:
         st.markdown("### All Agreements")
         
-        if filtered_agreements:
-            df = pd.DataFrame(filtered_agreements)
-            display_cols = ['agreement_id', 'agreement_name', 'customer_name', 'customer_segment',
-                           'status', 'agreement_value_ceiling', 'currency', 'account_manager',
-                           'utilization_percent', 'risk_flag']
-            
-            if all(col in df.columns for col in display_cols):
-                display_df = df[display_cols].copy()
-                display_df['agreement_value_ceiling'] = display_df.apply(
-                    lambda x: format_currency(x['agreement_value_ceiling'], x['currency']), axis=1
-                )
-                display_df['utilization_percent'] = display_df['utilization_percent'].apply(format_percentage)
-                display_df.columns = ['ID', 'Agreement', 'Customer', 'Segment', 'Status', 
-                                     'Ceiling', 'Currency', 'AM', 'Utilization', 'Risk']
-                st.dataframe(display_df.drop(columns=['Currency']), use_container_width=True, hide_index=True)
+        display_df = build_agreements_display_df(db_token, filter_key)
+        
+        if display_df is not None:
+            st.dataframe(display_df, use_container_width=True, hide_index=True,
+                         column_config={'Utilization': utilization_column()})
         else:
             st.info("No agreements found")
     
     with tab2:
         st.markdown("### Create New Agreement")
-        
-        with st.form("create_agreement_form"):
-            col1, col2 = st.columns(2)
+        render_create_agreement_tab()
+    
+    with tab3:
+        st.markdown("### Edit/View Agreement")
+        render_edit_agreement_tab(agreements_by_id)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PAGE: PURCHASE ORDERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@st.fragment
+def render_create_po_tab():
+    """Create PO tab; runs as a fragment so picking an agreement doesn't rerun the whole page"""
+    # Only show signed/active agreements
+    signed_agreements = agreements_for_ids(load_status_ids(db_token, (), POST_SIGNATURE_VALUES))
+    
+    if signed_agreements:
+        with st.form("create_po_form"):
+            agreement = st.selectbox(
+                "Select Agreement*", signed_agreements,
+                format_func=lambda a: f"{a['agreement_id']} - {a['customer_name']}"
+            )
+            agreement_id = agreement['agreement_id']
             
+            col1, col2, col3 = st.columns(3)
             with col1:
-                agreement_name = st.text_input("Agreement Name*", placeholder="e.g., AI Services Framework")
-                customer_name = st.text_input("Customer Name*", placeholder="e.g., Ministry of Interior")
-                customer_segment = st.selectbox("Customer Segment*", [s.value for s in CustomerSegment])
-                region = st.selectbox("Region", ["Central", "Western", "Eastern", "Northern", "Southern"])
-                industry = st.text_input("Industry", placeholder="e.g., Public Sector")
-                agreement_type = st.selectbox("Agreement Type*", [t.value for t in AgreementType])
-            
+                st.info(f"Ceiling: {format_currency(agreement['agreement_value_ceiling'], agreement['currency'])}")
             with col2:
-                agreement_value = st.number_input("Agreement Value Ceiling*", min_value=1.0, value=1000000.0)
-                currency = st.selectbox("Currency", [c.value for c in Currency])
-                status = st.selectbox("Initial Status", [s.value for s in AgreementStatus 
-                                                        if s in PRE_SIGNATURE_STATUSES])
-                account_manager = st.text_input("Account Manager*", placeholder="e.g., Mohammed Al-Shehri")
-                sales_owner = st.text_input("Sales Owner", placeholder="e.g., Ahmed Al-Harbi")
-                probability = st.slider("Probability to Sign (%)", 0, 100, 50)
+                st.info(f"Current POs: {format_currency(agreement['total_pos_value_to_date'])}")
+            with col3:
+                remaining = agreement['agreement_value_ceiling'] - agreement['total_pos_value_to_date']
+                st.info(f"Remaining: {format_currency(remaining, agreement['currency'])}")
             
             col1, col2 = st.columns(2)
+            
             with col1:
-                start_date = st.date_input("Start Date", value=date.today())
+                po_number = st.text_input("PO Number*", placeholder="e.g., PO-2025-001")
+                po_value = st.number_input("PO Value*", min_value=1.0, value=100000.0)
+                po_currency = st.selectbox("Currency", CURRENCY_VALUES)
+            
             with col2:
-                end_date = st.date_input("End Date", value=date.today() + timedelta(days=365))
+                po_date = st.date_input("PO Date", value=date.today())
+                customer_name = st.text_input("Customer Name", value=agreement['customer_name'])
+                account_manager = st.text_input("Account Manager", value=agreement['account_manager'] or "")
             
-            expected_sign = st.date_input("Expected Signature Date", value=date.today() + timedelta(days=30))
-            notes = st.text_area("Notes", placeholder="Additional details...")
+            po_notes = st.text_area("Notes", placeholder="Additional details...")
+            override = st.checkbox("Override ceiling check (Admin only)")
             
-            submitted = st.form_submit_button("Create Agreement", use_container_width=True)
+            po_submitted = st.form_submit_button("Create PO", use_container_width=True)
             
-            if submitted:
-                if not agreement_name or not customer_name or not account_manager:
-                    st.error("Please fill in all required fields (*)")
+            if po_submitted:
+                if not po_number:
+                    st.error("Please provide a PO number")
                 else:
                     try:
-                        agreement_data = {
-                            "agreement_name": agreement_name,
+                        po_data = {
+                            "agreement_id": agreement_id,
+                            "po_number": po_number,
+                            "po_date": po_date.isoformat(),
+                            "po_value": po_value,
+                            "currency": po_currency,
                             "customer_name": customer_name,
-                            "customer_segment": customer_segment,
-                            "region": region,
-                            "industry": industry,
-                            "agreement_type": agreement_type,
-                            "start_date": start_date.isoformat(),
-                            "end_date": end_date.isoformat(),
-                            "agreement_value_ceiling": agreement_value,
-                            "currency": currency,
-                            "status": status,
-                            "status_date": date.today().isoformat(),
                             "account_manager": account_manager,
-                            "sales_owner": sales_owner,
-                            "probability_to_sign": probability,
-                            "expected_signature_date": expected_sign.isoformat(),
-                            "notes": notes,
+                            "notes": po_notes,
                         }
                         
-                        agreement_id = create_agreement(conn, agreement_data)
-                        st.success(f"✅ Agreement created successfully! ID: {agreement_id}")
+                        with get_db() as conn, transaction(conn):
+                            po_id = create_po(conn, po_data, override_ceiling=override)
+                        st.success(f"✅ PO created successfully! ID: {po_id}")
+                        invalidate_cache()
                         st.rerun()
+                    except ValueError as e:
+                        st.error(f"Error: {e}")
                     except Exception as e:
-                        st.error(f"Error creating agreement: {e}")
-    
-    with tab3:
-        st.markdown("### Edit/View Agreement")
-        
-        agreement_ids = [a['agreement_id'] for a in all_agreements]
-        
-        if agreement_ids:
-            selected_id = st.selectbox("Select Agreement", agreement_ids)
-            
-            if selected_id:
-                agreement = get_agreement(conn, selected_id)
-                
-                if agreement:
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        st.metric("Status", agreement['status'])
-                    with col2:
-                        st.metric("Utilization", format_percentage(agreement['utilization_percent']))
-                    with col3:
-                        st.metric("Risk", agreement['risk_flag'])
-                    
-                    st.markdown("---")
-                    
-                    with st.form("edit_agreement_form"):
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            edit_name = st.text_input("Agreement Name", value=agreement['agreement_name'])
-                            edit_customer = st.text_input("Customer Name", value=agreement['customer_name'])
-                            
-                            current_status = AgreementStatus(agreement['status'])
-                            allowed_next = ALLOWED_STATUS_TRANSITIONS.get(current_status, [])
-                            status_options = [current_status.value] + [s.value for s in allowed_next]
-                            edit_status = st.selectbox("Status", status_options)
-                            
-                            edit_am = st.text_input("Account Manager", value=agreement['account_manager'] or "")
-                        
-                        with col2:
-                            edit_value = st.number_input("Value Ceiling", 
-                                                        value=float(agreement['agreement_value_ceiling']))
-                            edit_currency = st.selectbox("Currency", 
-                                                        [c.value for c in Currency],
-                                                        index=[c.value for c in Currency].index(agreement['currency']))
-                            
-                            if edit_status in [AgreementStatus.SIGNED.value, AgreementStatus.ACTIVE.value]:
-                                default_signed = datetime.strptime(agreement['signed_date'], "%Y-%m-%d").date() if agreement['signed_date'] else date.today()
-                                edit_signed_date = st.date_input("Signed Date", value=default_signed)
-                            else:
-                                edit_signed_date = None
-                                edit_prob = st.slider("Probability (%)", 0, 100, 
-                                                     int(agreement['probability_to_sign'] or 50))
-                        
-                        edit_notes = st.text_area("Notes", value=agreement['notes'] or "")
-                        
-                        update_submitted = st.form_submit_button("Update Agreement", use_container_width=True)
-                        
-                        if update_submitted:
-                            try:
-                                update_data = {
-                                    "agreement_name": edit_name,
-                                    "customer_name": edit_customer,
-                                    "status": edit_status,
-                                    "status_date": date.today().isoformat(),
-                                    "account_manager": edit_am,
-                                    "agreement_value_ceiling": edit_value,
-                                    "currency": edit_currency,
-                                    "notes": edit_notes,
-                                }
-                                
-                                if edit_signed_date:
-                                    update_data["signed_date"] = edit_signed_date.isoformat()
-                                elif 'edit_prob' in dir():
-                                    update_data["probability_to_sign"] = edit_prob
-                                
-                                update_agreement(conn, selected_id, update_data)
-                                st.success("✅ Agreement updated successfully!")
-                                st.rerun()
-                            except ValueError as e:
-                                st.error(f"Error: {e}")
-                            except Exception as e:
-                                st.error(f"Error updating agreement: {e}")
-                    
-                    # Delete button
-                    st.markdown("---")
-                    if st.button("🗑️ Delete Agreement", type="secondary"):
-                        if delete_agreement(conn, selected_id):
-                            st.success("Agreement deleted!")
-                            st.rerun()
-        else:
-            st.info("No agreements to edit")
-
-# ═══════════════════════════════════════════════════════════════════════════════
-# PAGE: PURCHASE ORDERS
-# ═══════════════════════════════════════════════════════════════════════════════
+                        st.error(f"Error creating PO: {e}")
+    else:
+        st.warning("No signed/active agreements available. Create and sign an agreement first.")
 
-elif page == "🧾 Purchase Orders":
+def render_purchase_orders():
+    """Purchase Orders page: list and create POs"""
     st.markdown("## 🧾 Purchase Orders")
     
     tab1, tab2 = st.tabs(["📋 All POs", "➕ Create PO"])
@@ -1122,95 +1341,78 @@ elif page == "🧾 Purchase Orders":
     with tab1:
         st.markdown("### All Purchase Orders")
         
-        all_pos = get_all_pos(conn)
+        display_df = build_pos_display_df(db_token)
         
-        if all_pos:
-            df = pd.DataFrame(all_pos)
-            display_df = df[['po_id', 'agreement_id', 'po_number', 'po_date', 
-                           'po_value', 'currency', 'customer_name', 'account_manager']].copy()
-            display_df['po_value'] = display_df.apply(
-                lambda x: format_currency(x['po_value'], x['currency']), axis=1
-            )
-            display_df.columns = ['PO ID', 'Agreement', 'PO Number', 'Date', 
-                                 'Value', 'Currency', 'Customer', 'AM']
-            st.dataframe(display_df.drop(columns=['Currency']), use_container_width=True, hide_index=True)
+        if display_df is not None:
+            st.dataframe(display_df, use_container_width=True, hide_index=True)
         else:
             st.info("No purchase orders found")
     
     with tab2:
         st.markdown("### Create Purchase Order")
-        
-        # Only show signed/active agreements
-        signed_agreements = [a for a in all_agreements 
-                           if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]]
-        
-        if signed_agreements:
-            with st.form("create_po_form"):
-                agreement_options = {f"{a['agreement_id']} - {a['customer_name']}": a['agreement_id'] 
-                                    for a in signed_agreements}
-                selected_agreement = st.selectbox("Select Agreement*", list(agreement_options.keys()))
-                agreement_id = agreement_options[selected_agreement]
-                
-                # Show agreement info
-                agreement = get_agreement(conn, agreement_id)
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.info(f"Ceiling: {format_currency(agreement['agreement_value_ceiling'], agreement['currency'])}")
-                with col2:
-                    st.info(f"Current POs: {format_currency(agreement['total_pos_value_to_date'])}")
-                with col3:
-                    remaining = agreement['agreement_value_ceiling'] - agreement['total_pos_value_to_date']
-                    st.info(f"Remaining: {format_currency(remaining, agreement['currency'])}")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    po_number = st.text_input("PO Number*", placeholder="e.g., PO-2025-001")
-                    po_value = st.number_input("PO Value*", min_value=1.0, value=100000.0)
-                    po_currency = st.selectbox("Currency", [c.value for c in Currency])
-                
-                with col2:
-                    po_date = st.date_input("PO Date", value=date.today())
-                    customer_name = st.text_input("Customer Name", value=agreement['customer_name'])
-                    account_manager = st.text_input("Account Manager", value=agreement['account_manager'] or "")
-                
-                po_notes = st.text_area("Notes", placeholder="Additional details...")
-                override = st.checkbox("Override ceiling check (Admin only)")
-                
-                po_submitted = st.form_submit_button("Create PO", use_container_width=True)
-                
-                if po_submitted:
-                    if not po_number:
-                        st.error("Please provide a PO number")
-                    else:
-                        try:
-                            po_data = {
-                                "agreement_id": agreement_id,
-                                "po_number": po_number,
-                                "po_date": po_date.isoformat(),
-                                "po_value": po_value,
-                                "currency": po_currency,
-                                "customer_name": customer_name,
-                                "account_manager": account_manager,
-                                "notes": po_notes,
-                            }
-                            
-                            po_id = create_po(conn, po_data, override_ceiling=override)
-                            st.success(f"✅ PO created successfully! ID: {po_id}")
-                            st.rerun()
-                        except ValueError as e:
-                            st.error(f"Error: {e}")
-                        except Exception as e:
-                            st.error(f"Error creating PO: {e}")
-        else:
-            st.warning("No signed/active agreements available. Create and sign an agreement first.")
+        render_create_po_tab()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE: IMPORT/EXPORT
 # ═══════════════════════════════════════════════════════════════════════════════
 
-elif page == "📤 Import/Export":
+def show_import_result(key):
+    """Show the outcome of an import saved in session state before its rerun, then clear it"""
+    result = st.session_state.pop(key, None)
+    if result is None:
+        return
+    label, created_count, errors = result
+    for error in errors:
+        st.warning(f"Error importing row: {error}")
+    st.success(f"Imported {created_count} {label}. {len(errors)} errors.")
+
+@st.fragment
+def render_import_section():
+    """CSV import widgets; runs as a fragment so uploads don't rerun the whole page"""
+    st.markdown("#### Import Agreements")
+    agreements_file = st.file_uploader("Upload Agreements CSV", type=['csv'], key='agreements_upload')
+    
+    if agreements_file:
+        try:
+            df = pd.read_csv(agreements_file)
+            st.dataframe(df.head(), use_container_width=True)
+            
+            if st.button("Import Agreements", use_container_width=True):
+                records = df.astype(object).where(df.notna(), None).to_dict('records')
+                with get_db() as conn:
+                    created, errors = bulk_create_agreements(conn, records)
+                
+                st.session_state['agreements_import_result'] = ('agreements', len(created), errors)
+                invalidate_cache()
+                st.rerun()
+        except Exception as e:
+            st.error(f"Error reading file: {e}")
+    
+    show_import_result('agreements_import_result')
+    
+    st.markdown("#### Import POs")
+    pos_file = st.file_uploader("Upload POs CSV", type=['csv'], key='pos_upload')
+    
+    if pos_file:
+        try:
+            df = pd.read_csv(pos_file)
+            st.dataframe(df.head(), use_container_width=True)
+            
+            if st.button("Import POs", use_container_width=True):
+                records = df.astype(object).where(df.notna(), None).to_dict('records')
+                with get_db() as conn:
+                    created, errors = bulk_create_pos(conn, records, override_ceiling=True)
+                
+                st.session_state['pos_import_result'] = ('POs', len(created), errors)
+                invalidate_cache()
+                st.rerun()
+        except Exception as e:
+            st.error(f"Error reading file: {e}")
+    
+    show_import_result('pos_import_result')
+
+def render_import_export():
+    """Import/Export page: CSV import/export and sample data"""
     st.markdown("## 📤 Import/Export Data")
     
     col1, col2 = st.columns(2)
@@ -1219,7 +1421,7 @@ elif page == "📤 Import/Export":
         st.markdown("### 📥 Export Data")
         
         st.markdown("#### Agreements")
-        agreements_csv = export_agreements_csv(conn)
+        agreements_csv = load_export_csv(db_token, 'agreements')
         if agreements_csv:
             st.download_button(
                 label="📥 Download Agreements CSV",
@@ -1232,7 +1434,7 @@ elif page == "📤 Import/Export":
             st.info("No agreements to export")
         
         st.markdown("#### Purchase Orders")
-        pos_csv = export_pos_csv(conn)
+        pos_csv = load_export_csv(db_token, 'pos')
         if pos_csv:
             st.download_button(
                 label="📥 Download POs CSV",
@@ -1246,60 +1448,7 @@ elif page == "📤 Import/Export":
     
     with col2:
         st.markdown("### 📤 Import Data")
-        
-        st.markdown("#### Import Agreements")
-        agreements_file = st.file_uploader("Upload Agreements CSV", type=['csv'], key='agreements_upload')
-        
-        if agreements_file:
-            try:
-                df = pd.read_csv(agreements_file)
-                st.dataframe(df.head(), use_container_width=True)
-                
-                if st.button("Import Agreements", use_container_width=True):
-                    success_count = 0
-                    error_count = 0
-                    
-                    for _, row in df.iterrows():
-                        try:
-                            data = row.to_dict()
-                            # Clean NaN values
-                            data = {k: (v if pd.notna(v) else None) for k, v in data.items()}
-                            create_agreement(conn, data)
-                            success_count += 1
-                        except Exception as e:
-                            error_count += 1
-                            st.warning(f"Error importing row: {e}")
-                    
-                    st.success(f"Imported {success_count} agreements. {error_count} errors.")
-                    st.rerun()
-            except Exception as e:
-                st.error(f"Error reading file: {e}")
-        
-        st.markdown("#### Import POs")
-        pos_file = st.file_uploader("Upload POs CSV", type=['csv'], key='pos_upload')
-        
-        if pos_file:
-            try:
-                df = pd.read_csv(pos_file)
-                st.dataframe(df.head(), use_container_width=True)
-                
-                if st.button("Import POs", use_container_width=True):
-                    success_count = 0
-                    error_count = 0
-                    
-                    for _, row in df.iterrows():
-                        try:
-                            data = row.to_dict()
-                            data = {k: (v if pd.notna(v) else None) for k, v in data.items()}
-                            create_po(conn, data, override_ceiling=True)
-                            success_count += 1
-                        except Exception as e:
-                            error_count += 1
-                    
-                    st.success(f"Imported {success_count} POs. {error_count} errors.")
-                    st.rerun()
-            except Exception as e:
-                st.error(f"Error reading file: {e}")
+        render_import_section()
     
     st.markdown("---")
     
@@ -1310,19 +1459,36 @@ elif page == "📤 Import/Export":
     
     with col1:
         if st.button("🎲 Generate Sample Data", use_container_width=True):
-            from sample_data import generate_sample_data, clear_all_data
-            clear_all_data(DB_PATH)
-            generate_sample_data(DB_PATH)
+            reset_sample_data(DB_PATH)
             st.success("✅ Sample data generated!")
+            invalidate_cache()
             st.rerun()
     
     with col2:
         if st.button("🗑️ Clear All Data", type="secondary", use_container_width=True):
-            from sample_data import clear_all_data
             clear_all_data(DB_PATH)
             st.success("✅ All data cleared!")
+            invalidate_cache()
             st.rerun()
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# PAGE DISPATCH
+# ═══════════════════════════════════════════════════════════════════════════════
+
+PAGES = {
+    "🏠 Overview": render_overview,
+    "📈 Pipeline": render_pipeline,
+    "💰 Monetization": render_monetization,
+    "👤 Account Managers": render_account_managers,
+    "⚠️ Aging & Risk": render_aging_risk,
+    "📊 Forecast": render_forecast,
+    "📝 Agreements": render_agreements,
+    "🧾 Purchase Orders": render_purchase_orders,
+    "📤 Import/Export": render_import_export,
+}
+
+PAGES[page]()
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # FOOTER
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -4,8 +4,12 @@ Handles SQLite database operations, schema, and business logic
 """
 
 import sqlite3
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
-from typing import Optional, List, Dict, Any, Tuple
+from itertools import chain
+from typing import Optional, List, Dict, Any, Tuple, Iterable, Iterator
 from dataclasses import dataclass, asdict
 from enum import Enum
 import json
@@ -84,108 +88,309 @@ POST_SIGNATURE_STATUSES = [
     AgreementStatus.ACTIVE,
 ]
 
+# Status value sets for O(1) membership checks
+PRE_SIGNATURE_VALUES = frozenset(s.value for s in PRE_SIGNATURE_STATUSES)
+POST_SIGNATURE_VALUES = frozenset(s.value for s in POST_SIGNATURE_STATUSES)
+ALLOWED_STATUS_TRANSITION_VALUES = {
+    old.value: frozenset(new.value for new in allowed) for old, allowed in ALLOWED_STATUS_TRANSITIONS.items()
+}
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # DATABASE CONNECTION & SCHEMA
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def get_connection(db_path: str = "gtm_dashboard.db") -> sqlite3.Connection:
+# Stored in PRAGMA user_version once the schema is in place; bump on schema changes
+SCHEMA_VERSION = 7
+
+# STRICT tables and PRAGMA table_list need 3.37 (RETURNING and MATERIALIZED CTEs need 3.35)
+MIN_SQLITE_VERSION = (3, 37, 0)
+
+# SAR conversion of a row's own "currency" column, for the generated *_sar columns. Built from
+# FX_RATES when the tables are created; existing tables keep the rates they were created with
+SAR_FACTOR_SQL = "CASE currency {} ELSE 1.0 END".format(
+    " ".join(f"WHEN '{code}' THEN {rate!r}" for code, rate in FX_RATES.items() if rate != 1.0)
+)
+
+# Column definitions per table, in creation order (pos and status_history reference agreements).
+# Tables are STRICT, so dates and timestamps are ISO-8601 TEXT.
+TABLE_DEFINITIONS = {
+    'agreements': f"""
+        agreement_id TEXT PRIMARY KEY,
+        agreement_name TEXT NOT NULL,
+        customer_name TEXT NOT NULL,
+        customer_segment TEXT NOT NULL,
+        region TEXT,
+        industry TEXT,
+        agreement_type TEXT NOT NULL,
+        start_date TEXT,
+        end_date TEXT,
+        agreement_value_ceiling REAL NOT NULL CHECK(agreement_value_ceiling > 0),
+        currency TEXT NOT NULL DEFAULT 'SAR',
+        status TEXT NOT NULL DEFAULT 'Pipeline',
+        status_date TEXT NOT NULL,
+        account_manager TEXT NOT NULL,
+        sales_owner TEXT,
+        partnerships_vendors TEXT,
+        probability_to_sign REAL CHECK(probability_to_sign >= 0 AND probability_to_sign <= 100),
+        expected_signature_date TEXT,
+        signed_date TEXT,
+        renewal_terms TEXT,
+        notes TEXT,
+        attachments TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+        ceiling_sar REAL GENERATED ALWAYS AS (agreement_value_ceiling * {SAR_FACTOR_SQL}) STORED
+    """,
+    'pos': f"""
+        po_id TEXT PRIMARY KEY,
+        agreement_id TEXT NOT NULL,
+        po_number TEXT NOT NULL,
+        po_date TEXT NOT NULL,
+        po_value REAL NOT NULL CHECK(po_value > 0),
+        currency TEXT NOT NULL DEFAULT 'SAR',
+        customer_name TEXT NOT NULL,
+        account_manager TEXT,
+        notes TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_updated TEXT DEFAULT CURRENT_TIMESTAMP,
+        value_sar REAL GENERATED ALWAYS AS (po_value * {SAR_FACTOR_SQL}) STORED,
+        FOREIGN KEY (agreement_id) REFERENCES agreements(agreement_id) ON DELETE CASCADE
+    """,
+    # Users table (optional)
+    'users': """
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        role TEXT NOT NULL DEFAULT 'Viewer',
+        email TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    """,
+    # Status history table for tracking transitions
+    'status_history': """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        agreement_id TEXT NOT NULL,
+        old_status TEXT,
+        new_status TEXT NOT NULL,
+        changed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        changed_by TEXT,
+        FOREIGN KEY (agreement_id) REFERENCES agreements(agreement_id) ON DELETE CASCADE
+    """,
+    # Sequence table for agreement and per-agreement PO ID generation
+    'sequences': """
+        seq_name TEXT PRIMARY KEY,
+        seq_value INTEGER NOT NULL DEFAULT 0
+    """,
+}
+
+# WAL lets dashboard reads run alongside a writer; expect -wal/-shm files next to the DB
+CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA cache_size=-65536;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA busy_timeout=5000;
+    PRAGMA foreign_keys=ON;
+"""
+
+# Idle connections shared by every thread in the process, keyed by (db_path, readonly);
+# pooled_connection checks one out under _pool_lock so no two threads use it at once
+_idle_connections: Dict[Tuple[str, bool], List[sqlite3.Connection]] = {}
+_pool_lock = threading.Lock()
+
+# Connections kept open per database; extra ones opened under concurrent load are closed on return
+POOL_MAX_IDLE = 4
+
+# Serializes schema creation when several threads call init_database at once
+_schema_lock = threading.Lock()
+
+def get_connection(db_path: str = "gtm_dashboard.db", readonly: bool = False) -> sqlite3.Connection:
     """Get database connection with row factory"""
-    conn = sqlite3.connect(db_path, check_same_thread=False)
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=256)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        # Stored in the database file, so every later connection (including read-only ones) opens in WAL
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    conn.executescript(CONNECTION_PRAGMAS)
     return conn
 
+@contextmanager
+def pooled_connection(db_path: str = "gtm_dashboard.db", readonly: bool = False) -> Iterator[sqlite3.Connection]:
+    """Check out an idle pooled connection (opening one if none is free) for the block, then return it"""
+    key = (db_path, readonly)
+    with _pool_lock:
+        idle = _idle_connections.setdefault(key, [])
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = get_connection(db_path, readonly)
+    try:
+        yield conn
+    finally:
+        # Never hand a half-finished transaction to the next borrower
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            idle = _idle_connections.setdefault(key, [])
+            if len(idle) < POOL_MAX_IDLE:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+def fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict]:
+    """Fetch the remaining rows as plain dicts, reading column names from cursor.description once"""
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+# Bound-parameter cap of SQLite builds before 3.32; newer builds allow more
+SQLITE_MAX_VARIABLES = 999
+
+def insert_sql(table: str, columns: Tuple[str, ...], rows: int = 1) -> str:
+    """INSERT statement with one VALUES group per row"""
+    values = f"({', '.join('?' * len(columns))})"
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([values] * rows)}"
+
+def insert_rows(cursor: sqlite3.Cursor, table: str, columns: Tuple[str, ...], rows: List[Tuple]) -> None:
+    """Insert rows with multi-row VALUES statements, chunked under SQLITE_MAX_VARIABLES"""
+    per_statement = max(1, SQLITE_MAX_VARIABLES // len(columns))
+    for start in range(0, len(rows), per_statement):
+        chunk = rows[start:start + per_statement]
+        cursor.execute(insert_sql(table, columns, len(chunk)), list(chain.from_iterable(chunk)))
+
+# Connections (by id) with a transaction() block open on the current thread
+_open_transactions = threading.local()
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Run the block as one BEGIN IMMEDIATE/COMMIT unit; joins a transaction this thread already opened"""
+    owned = getattr(_open_transactions, "conns", None)
+    if owned is None:
+        owned = _open_transactions.conns = set()
+    if id(conn) in owned:
+        yield conn
+        return
+    # Never join a transaction begun elsewhere (another thread, or a bare write): its
+    # rollback would silently discard this block's changes
+    if conn.in_transaction:
+        raise RuntimeError("Connection already has a transaction open outside this thread's transaction()")
+    conn.execute("BEGIN IMMEDIATE")
+    owned.add(id(conn))
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        owned.discard(id(conn))
+
+def create_table_sql(name: str, table: Optional[str] = None) -> str:
+    """CREATE TABLE statement for one of TABLE_DEFINITIONS, optionally under another table name"""
+    return f"CREATE TABLE IF NOT EXISTS {table or name} ({TABLE_DEFINITIONS[name]}) STRICT"
+
+def rebuild_table(cursor: sqlite3.Cursor, name: str):
+    """Recreate a table from TABLE_DEFINITIONS and copy its rows across (run with foreign_keys OFF)"""
+    new = f"{name}_new"
+    cursor.execute(f"DROP TABLE IF EXISTS {new}")
+    cursor.execute(create_table_sql(name, new))
+    
+    # Generated columns (hidden != 0) are recomputed by the new table, not copied
+    old_columns = {row['name'] for row in cursor.execute(f"PRAGMA table_xinfo({name})") if row['hidden'] == 0}
+    columns = ', '.join(row['name'] for row in cursor.execute(f"PRAGMA table_xinfo({new})")
+                        if row['hidden'] == 0 and row['name'] in old_columns)
+    
+    cursor.execute(f"INSERT INTO {new} ({columns}) SELECT {columns} FROM {name}")
+    cursor.execute(f"DROP TABLE {name}")
+    cursor.execute(f"ALTER TABLE {new} RENAME TO {name}")
+
+# Indexes for the filter columns, the default ordering and per-agreement lookups
+# ((status, signed_date) also serves the aging scans; the PO index covers SUM(value_sar) per agreement)
+SECONDARY_INDEXES = {
+    'idx_agreements_status_signed': 'agreements(status, signed_date)',
+    'idx_agreements_am': 'agreements(account_manager)',
+    'idx_agreements_region': 'agreements(region)',
+    'idx_agreements_industry': 'agreements(industry)',
+    'idx_agreements_segment': 'agreements(customer_segment)',
+    'idx_agreements_updated': 'agreements(last_updated DESC)',
+    'idx_pos_agreement_valuesar': 'pos(agreement_id, value_sar)',
+    'idx_status_history_agreement': 'status_history(agreement_id)',
+}
+
+def drop_secondary_indexes(conn: sqlite3.Connection) -> None:
+    """Drop SECONDARY_INDEXES ahead of a bulk load (safe inside transaction(conn))"""
+    for name in SECONDARY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+def create_secondary_indexes(conn: sqlite3.Connection) -> None:
+    """Create any missing SECONDARY_INDEXES (safe inside transaction(conn))"""
+    for name, target in SECONDARY_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
 def init_database(db_path: str = "gtm_dashboard.db"):
-    """Initialize database with schema"""
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
-    
-    # Agreements table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS agreements (
-            agreement_id TEXT PRIMARY KEY,
-            agreement_name TEXT NOT NULL,
-            customer_name TEXT NOT NULL,
-            customer_segment TEXT NOT NULL,
-            region TEXT,
-            industry TEXT,
-            agreement_type TEXT NOT NULL,
-            start_date DATE,
-            end_date DATE,
-            agreement_value_ceiling REAL NOT NULL CHECK(agreement_value_ceiling > 0),
-            currency TEXT NOT NULL DEFAULT 'SAR',
-            status TEXT NOT NULL DEFAULT 'Pipeline',
-            status_date DATE NOT NULL,
-            account_manager TEXT NOT NULL,
-            sales_owner TEXT,
-            partnerships_vendors TEXT,
-            probability_to_sign REAL CHECK(probability_to_sign >= 0 AND probability_to_sign <= 100),
-            expected_signature_date DATE,
-            signed_date DATE,
-            renewal_terms TEXT,
-            notes TEXT,
-            attachments TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # POs table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pos (
-            po_id TEXT PRIMARY KEY,
-            agreement_id TEXT NOT NULL,
-            po_number TEXT NOT NULL,
-            po_date DATE NOT NULL,
-            po_value REAL NOT NULL CHECK(po_value > 0),
-            currency TEXT NOT NULL DEFAULT 'SAR',
-            customer_name TEXT NOT NULL,
-            account_manager TEXT,
-            notes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (agreement_id) REFERENCES agreements(agreement_id)
-        )
-    """)
-    
-    # Users table (optional)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            role TEXT NOT NULL DEFAULT 'Viewer',
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Status history table for tracking transitions
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS status_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            agreement_id TEXT NOT NULL,
-            old_status TEXT,
-            new_status TEXT NOT NULL,
-            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            changed_by TEXT,
-            FOREIGN KEY (agreement_id) REFERENCES agreements(agreement_id)
+    """Initialize database with schema (no-op if already at SCHEMA_VERSION)"""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} or newer is required, "
+            f"but Python's sqlite3 module is linked against {sqlite3.sqlite_version}"
         )
-    """)
-    
-    # Sequence table for agreement ID generation
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sequences (
-            seq_name TEXT PRIMARY KEY,
-            seq_value INTEGER NOT NULL DEFAULT 0
-        )
-    """)
-    
-    # Initialize sequence if not exists
-    cursor.execute("""
-        INSERT OR IGNORE INTO sequences (seq_name, seq_value) VALUES ('agreement', 0)
-    """)
     
-    conn.commit()
-    conn.close()
+    with _schema_lock:
+        conn = get_connection(db_path)
+        cursor = conn.cursor()
+        
+        if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            conn.close()
+            return
+        
+        for name in TABLE_DEFINITIONS:
+            cursor.execute(create_table_sql(name))
+        
+        # STRICT, generated SAR columns and cascading foreign keys can't be added in place:
+        # rebuild tables created by older versions of the schema
+        strict = {row['name']: row['strict'] for row in cursor.execute("PRAGMA table_list")}
+        stale = [
+            table for table in TABLE_DEFINITIONS
+            if not strict.get(table)
+            or any(fk['on_delete'] != 'CASCADE' for fk in cursor.execute(f"PRAGMA foreign_key_list({table})"))
+        ]
+        if stale:
+            conn.execute("PRAGMA foreign_keys=OFF")
+            with transaction(conn):
+                for table in stale:
+                    rebuild_table(cursor, table)
+            conn.execute("PRAGMA foreign_keys=ON")
+        
+        # Indexes replaced by wider ones in SECONDARY_INDEXES
+        cursor.executescript("""
+            DROP INDEX IF EXISTS idx_agreements_status;
+            DROP INDEX IF EXISTS idx_pos_agreement;
+        """)
+        create_secondary_indexes(conn)
+        
+        # Status history is written by triggers, inside the same statement as the agreement change
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS trg_agreements_insert AFTER INSERT ON agreements
+            BEGIN
+                INSERT INTO status_history (agreement_id, new_status, changed_at)
+                VALUES (NEW.agreement_id, NEW.status, NEW.last_updated);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_agreements_status_update AFTER UPDATE OF status ON agreements
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO status_history (agreement_id, old_status, new_status, changed_at)
+                VALUES (NEW.agreement_id, OLD.status, NEW.status, NEW.last_updated);
+            END;
+        """)
+        
+        # Initialize sequence if not exists
+        cursor.execute("""
+            INSERT OR IGNORE INTO sequences (seq_name, seq_value) VALUES ('agreement', 0)
+        """)
+        
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        conn.close()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # ID GENERATION
@@ -193,21 +398,43 @@ def init_database(db_path: str = "gtm_dashboard.db"):
 
 def generate_agreement_id(conn: sqlite3.Connection) -> str:
     """Generate unique agreement ID in format AGR-YYYY-0001"""
-    cursor = conn.cursor()
+    return generate_agreement_ids(conn, 1)[0]
+
+def generate_agreement_ids(conn: sqlite3.Connection, count: int,
+                           cursor: Optional[sqlite3.Cursor] = None) -> List[str]:
+    """Reserve a block of consecutive agreement IDs with a single sequence update (on cursor if given)"""
+    cursor = cursor or conn.cursor()
     year = datetime.now().year
     
-    cursor.execute("UPDATE sequences SET seq_value = seq_value + 1 WHERE seq_name = 'agreement'")
-    cursor.execute("SELECT seq_value FROM sequences WHERE seq_name = 'agreement'")
-    seq = cursor.fetchone()[0]
+    cursor.execute("""
+        UPDATE sequences SET seq_value = seq_value + ? WHERE seq_name = 'agreement'
+        RETURNING seq_value
+    """, (count,))
+    last = cursor.fetchall()[0][0]
     
-    return f"AGR-{year}-{seq:04d}"
+    return [f"AGR-{year}-{seq:04d}" for seq in range(last - count + 1, last + 1)]
 
 def generate_po_id(conn: sqlite3.Connection, agreement_id: str) -> str:
     """Generate unique PO ID"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM pos WHERE agreement_id = ?", (agreement_id,))
-    count = cursor.fetchone()[0] + 1
-    return f"PO-{agreement_id.replace('AGR-', '')}-{count:03d}"
+    return generate_po_ids(conn, agreement_id, 1)[0]
+
+def generate_po_ids(conn: sqlite3.Connection, agreement_id: str, count: int,
+                    cursor: Optional[sqlite3.Cursor] = None) -> List[str]:
+    """Reserve a block of PO IDs from the agreement's 'po:<agreement_id>' sequence row (on cursor if given)"""
+    cursor = cursor or conn.cursor()
+    seq_name = f"po:{agreement_id}"
+    
+    # One upsert: the first PO for this agreement seeds the counter from any POs created before it existed
+    cursor.execute("""
+        INSERT INTO sequences (seq_name, seq_value)
+        SELECT :seq_name, COUNT(*) + :count FROM pos WHERE agreement_id = :agreement_id
+        ON CONFLICT (seq_name) DO UPDATE SET seq_value = seq_value + :count
+        RETURNING seq_value
+    """, {'seq_name': seq_name, 'count': count, 'agreement_id': agreement_id})
+    last = cursor.fetchall()[0][0]
+    
+    prefix = f"PO-{agreement_id.replace('AGR-', '')}"
+    return [f"{prefix}-{seq:03d}" for seq in range(last - count + 1, last + 1)]
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CURRENCY CONVERSION
@@ -221,58 +448,58 @@ def convert_to_sar(amount: float, currency: str) -> float:
 # CALCULATED FIELDS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def calculate_days_since_signature(signed_date: Optional[str]) -> Optional[int]:
-    """Calculate days since signature"""
+def calculate_days_since_signature(signed_date: Optional[str], today: Optional[date] = None) -> Optional[int]:
+    """Calculate days since signature (pass today to reuse one date across many rows)"""
     if not signed_date:
         return None
-    signed = datetime.strptime(signed_date, "%Y-%m-%d").date()
-    return (date.today() - signed).days
+    return ((today or date.today()) - date.fromisoformat(signed_date)).days
+
+# Aging buckets start at these day counts: <30d, 30-60d, 61-90d, >90d
+AGING_BUCKET_EDGES = (30, 61, 91)
+AGING_BUCKET_LABELS = tuple(bucket.value for bucket in AgingBucket)
+
+# Risk rules only distinguish <=30, 31-60, 61-90 and >90 days since signature
+RISK_DAY_EDGES = (31, 61, 91)
+
+# Risk flag for every (signed/active, day class, no POs, utilization < 10%) combination:
+# Red when signed/active >90 days with no POs; Amber at 31-90 days with no POs or <10% used after 60 days
+RISK_FLAG_TABLE = {
+    (signed, day_class, no_pos, low_utilization): (
+        RiskFlag.RED.value if signed and day_class == 3 and no_pos
+        else RiskFlag.AMBER.value if signed and ((day_class in (1, 2) and no_pos) or (day_class >= 2 and low_utilization))
+        else RiskFlag.GREEN.value
+    )
+    for signed in (False, True)
+    for day_class in range(len(RISK_DAY_EDGES) + 1)
+    for no_pos in (False, True)
+    for low_utilization in (False, True)
+}
 
 def calculate_aging_bucket(days: Optional[int]) -> Optional[str]:
     """Determine aging bucket based on days since signature"""
     if days is None:
         return None
-    if days < 30:
-        return AgingBucket.LESS_30.value
-    elif days <= 60:
-        return AgingBucket.DAYS_30_60.value
-    elif days <= 90:
-        return AgingBucket.DAYS_61_90.value
-    else:
-        return AgingBucket.MORE_90.value
+    return AGING_BUCKET_LABELS[bisect_right(AGING_BUCKET_EDGES, days)]
 
 def calculate_risk_flag(status: str, days_since_signature: Optional[int], 
                         total_pos_value: float, utilization_percent: float) -> str:
-    """Calculate risk flag based on business rules"""
-    if status not in [AgreementStatus.SIGNED.value, AgreementStatus.ACTIVE.value]:
-        return RiskFlag.GREEN.value
-    
+    """Calculate risk flag based on business rules (looked up in RISK_FLAG_TABLE)"""
     if days_since_signature is None:
         return RiskFlag.GREEN.value
-    
-    # Red: Signed/Active AND >90 days AND no POs
-    if days_since_signature > 90 and total_pos_value == 0:
-        return RiskFlag.RED.value
-    
-    # Amber: 31-90 days AND no POs OR utilization < 10% after 60 days
-    if (31 <= days_since_signature <= 90 and total_pos_value == 0) or \
-       (days_since_signature > 60 and utilization_percent < 10):
-        return RiskFlag.AMBER.value
-    
-    return RiskFlag.GREEN.value
+    return RISK_FLAG_TABLE[(
+        status in POST_SIGNATURE_VALUES,
+        bisect_right(RISK_DAY_EDGES, days_since_signature),
+        total_pos_value == 0,
+        utilization_percent < 10,
+    )]
+
+# SAR total of the POs joined as "p", for queries that GROUP BY agreement
+POS_TOTAL_SAR_SQL = "COALESCE(SUM(p.value_sar), 0)"
 
 def get_total_pos_value(conn: sqlite3.Connection, agreement_id: str) -> float:
     """Get total PO value for an agreement (converted to SAR)"""
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COALESCE(SUM(po_value * 
-            CASE currency 
-                WHEN 'USD' THEN 3.75 
-                WHEN 'EUR' THEN 4.05 
-                ELSE 1.0 
-            END), 0) as total
-        FROM pos WHERE agreement_id = ?
-    """, (agreement_id,))
+    cursor.execute("SELECT COALESCE(SUM(value_sar), 0) as total FROM pos WHERE agreement_id = ?", (agreement_id,))
     return cursor.fetchone()[0]
 
 def calculate_utilization(total_pos_value: float, ceiling_value: float) -> float:
@@ -281,27 +508,69 @@ def calculate_utilization(total_pos_value: float, ceiling_value: float) -> float
         return 0.0
     return (total_pos_value / ceiling_value) * 100
 
+def add_calculated_fields(agreement: Dict, total_pos: float, today: Optional[date] = None) -> Dict:
+    """Attach PO total, utilization, aging and risk fields to an agreement row (with its stored ceiling_sar)"""
+    ceiling_sar = agreement['ceiling_sar']
+    days_since = calculate_days_since_signature(agreement['signed_date'], today)
+    utilization = calculate_utilization(total_pos, ceiling_sar)
+    
+    agreement['total_pos_value_to_date'] = total_pos
+    agreement['is_monetizing'] = total_pos > 0
+    agreement['utilization_percent'] = utilization
+    agreement['days_since_signature'] = days_since
+    agreement['aging_bucket'] = calculate_aging_bucket(days_since)
+    agreement['risk_flag'] = calculate_risk_flag(
+        agreement['status'], days_since, total_pos, utilization
+    )
+    return agreement
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # AGREEMENT CRUD OPERATIONS
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def create_agreement(conn: sqlite3.Connection, data: Dict[str, Any]) -> str:
-    """Create a new agreement"""
-    cursor = conn.cursor()
-    
-    agreement_id = generate_agreement_id(conn)
-    now = datetime.now().isoformat()
-    
-    cursor.execute("""
-        INSERT INTO agreements (
-            agreement_id, agreement_name, customer_name, customer_segment,
-            region, industry, agreement_type, start_date, end_date,
-            agreement_value_ceiling, currency, status, status_date,
-            account_manager, sales_owner, partnerships_vendors,
-            probability_to_sign, expected_signature_date, signed_date,
-            renewal_terms, notes, attachments, created_at, last_updated
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+# Column order of agreement_row()
+AGREEMENT_INSERT_COLUMNS = (
+    'agreement_id', 'agreement_name', 'customer_name', 'customer_segment',
+    'region', 'industry', 'agreement_type', 'start_date', 'end_date',
+    'agreement_value_ceiling', 'currency', 'status', 'status_date',
+    'account_manager', 'sales_owner', 'partnerships_vendors',
+    'probability_to_sign', 'expected_signature_date', 'signed_date',
+    'renewal_terms', 'notes', 'attachments', 'created_at', 'last_updated',
+)
+AGREEMENT_INSERT_SQL = insert_sql('agreements', AGREEMENT_INSERT_COLUMNS)
+
+# Every editable column, so update_agreement always binds the same (cached) statement
+AGREEMENT_UPDATE_COLUMNS = (
+    'agreement_name', 'customer_name', 'customer_segment', 'region', 'industry',
+    'agreement_type', 'start_date', 'end_date', 'agreement_value_ceiling', 'currency',
+    'status', 'status_date', 'account_manager', 'sales_owner', 'partnerships_vendors',
+    'probability_to_sign', 'expected_signature_date', 'signed_date', 'renewal_terms',
+    'notes', 'attachments',
+)
+AGREEMENT_SELECT_EDITABLE_SQL = (
+    f"SELECT {', '.join(AGREEMENT_UPDATE_COLUMNS)} FROM agreements WHERE agreement_id = ?"
+)
+AGREEMENT_UPDATE_SQL = (
+    f"UPDATE agreements SET {', '.join(f'{col} = ?' for col in AGREEMENT_UPDATE_COLUMNS)}, "
+    f"last_updated = ? WHERE agreement_id = ?"
+)
+
+# Explicit projections: everything for the detail view and exports, no free-text columns for lists
+AGREEMENT_COLUMNS = ('agreement_id',) + AGREEMENT_UPDATE_COLUMNS + ('created_at', 'last_updated', 'ceiling_sar')
+AGREEMENT_LIST_COLUMNS = tuple(
+    col for col in AGREEMENT_COLUMNS
+    if col not in ('partnerships_vendors', 'renewal_terms', 'notes', 'attachments', 'created_at')
+)
+
+# Columns that must be present (NOT NULL without a usable default) on import
+AGREEMENT_REQUIRED_FIELDS = (
+    'agreement_name', 'customer_name', 'customer_segment', 'agreement_type',
+    'agreement_value_ceiling', 'account_manager',
+)
+
+def agreement_row(agreement_id: str, data: Dict[str, Any], now: str) -> Tuple:
+    """Parameter tuple for AGREEMENT_INSERT_SQL (now is an ISO timestamp; its date is the status_date default)"""
+    return (
         agreement_id,
         data.get('agreement_name'),
         data.get('customer_name'),
@@ -314,7 +583,7 @@ def create_agreement(conn: sqlite3.Connection, data: Dict[str, Any]) -> str:
         data.get('agreement_value_ceiling'),
         data.get('currency', 'SAR'),
         data.get('status', 'Pipeline'),
-        data.get('status_date', date.today().isoformat()),
+        data.get('status_date', now[:10]),
         data.get('account_manager'),
         data.get('sales_owner'),
         data.get('partnerships_vendors'),
@@ -326,175 +595,243 @@ def create_agreement(conn: sqlite3.Connection, data: Dict[str, Any]) -> str:
         data.get('attachments'),
         now,
         now
-    ))
+    )
+
+def validate_agreement_data(data: Dict[str, Any]) -> Optional[str]:
+    """Check an agreement record against the table constraints; returns an error message or None"""
+    missing = [f for f in AGREEMENT_REQUIRED_FIELDS if data.get(f) is None]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    for field in ('currency', 'status', 'status_date'):
+        if field in data and data[field] is None:
+            return f"missing {field}"
+    try:
+        if float(data['agreement_value_ceiling']) <= 0:
+            return "agreement_value_ceiling must be positive"
+        probability = data.get('probability_to_sign')
+        if probability is not None and not 0 <= float(probability) <= 100:
+            return "probability_to_sign must be between 0 and 100"
+    except (TypeError, ValueError):
+        return "non-numeric ceiling or probability"
+    return None
+
+def create_agreement(conn: sqlite3.Connection, data: Dict[str, Any]) -> str:
+    """Create a new agreement (run inside transaction(conn))"""
+    cursor = conn.cursor()
     
-    # Record status history
-    cursor.execute("""
-        INSERT INTO status_history (agreement_id, new_status, changed_at)
-        VALUES (?, ?, ?)
-    """, (agreement_id, data.get('status', 'Pipeline'), now))
+    agreement_id = generate_agreement_id(conn)
+    now = datetime.now().isoformat()
+    
+    # trg_agreements_insert records the initial status history row
+    cursor.execute(AGREEMENT_INSERT_SQL, agreement_row(agreement_id, data, now))
     
-    conn.commit()
     return agreement_id
 
+def bulk_create_agreements(conn: sqlite3.Connection, records: List[Dict[str, Any]],
+                           cursor: Optional[sqlite3.Cursor] = None) -> Tuple[List[str], List[str]]:
+    """Insert many agreements in one transaction; returns (created IDs, per-row error messages)"""
+    valid = []
+    errors = []
+    for i, data in enumerate(records, start=1):
+        error = validate_agreement_data(data)
+        if error:
+            errors.append(f"Row {i}: {error}")
+        else:
+            valid.append(data)
+    
+    if not valid:
+        return [], errors
+    
+    now = datetime.now().isoformat()
+    with transaction(conn):
+        cursor = cursor or conn.cursor()
+        agreement_ids = generate_agreement_ids(conn, len(valid), cursor)
+        insert_rows(cursor, 'agreements', AGREEMENT_INSERT_COLUMNS, [
+            agreement_row(agreement_id, data, now) for agreement_id, data in zip(agreement_ids, valid)
+        ])
+    
+    return agreement_ids, errors
+
 def update_agreement(conn: sqlite3.Connection, agreement_id: str, data: Dict[str, Any]) -> bool:
-    """Update an existing agreement"""
+    """Update an existing agreement (run inside transaction(conn))"""
     cursor = conn.cursor()
     
-    # Get current status for history tracking
-    cursor.execute("SELECT status FROM agreements WHERE agreement_id = ?", (agreement_id,))
+    # Current values fill in every column the caller didn't change
+    cursor.execute(AGREEMENT_SELECT_EDITABLE_SQL, (agreement_id,))
     row = cursor.fetchone()
     if not row:
         return False
     
-    old_status = row['status']
+    unknown = set(data) - set(AGREEMENT_UPDATE_COLUMNS) - {'agreement_id'}
+    if unknown:
+        raise ValueError(f"Unknown agreement fields: {', '.join(sorted(unknown))}")
+    
+    current = dict(row)
+    old_status = current['status']
     new_status = data.get('status', old_status)
     
     # Validate status transition if status is changing
-    if old_status != new_status:
-        old_status_enum = AgreementStatus(old_status)
-        new_status_enum = AgreementStatus(new_status)
-        
-        if new_status_enum not in ALLOWED_STATUS_TRANSITIONS.get(old_status_enum, []):
-            raise ValueError(f"Invalid status transition from {old_status} to {new_status}")
-    
-    # Build update query dynamically
-    update_fields = []
-    values = []
+    if old_status != new_status and new_status not in ALLOWED_STATUS_TRANSITION_VALUES.get(old_status, ()):
+        raise ValueError(f"Invalid status transition from {old_status} to {new_status}")
     
-    for key, value in data.items():
-        if key != 'agreement_id':
-            update_fields.append(f"{key} = ?")
-            values.append(value)
-    
-    update_fields.append("last_updated = ?")
+    current.update((key, value) for key, value in data.items() if key != 'agreement_id')
+    values = [current[col] for col in AGREEMENT_UPDATE_COLUMNS]
     values.append(datetime.now().isoformat())
     values.append(agreement_id)
+    # trg_agreements_status_update records the transition if the status changed
+    cursor.execute(AGREEMENT_UPDATE_SQL, values)
     
-    query = f"UPDATE agreements SET {', '.join(update_fields)} WHERE agreement_id = ?"
-    cursor.execute(query, values)
-    
-    # Record status change if applicable
-    if old_status != new_status:
-        cursor.execute("""
-            INSERT INTO status_history (agreement_id, old_status, new_status, changed_at)
-            VALUES (?, ?, ?, ?)
-        """, (agreement_id, old_status, new_status, datetime.now().isoformat()))
-    
-    conn.commit()
     return True
 
 def get_agreement(conn: sqlite3.Connection, agreement_id: str) -> Optional[Dict]:
     """Get a single agreement with calculated fields"""
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM agreements WHERE agreement_id = ?", (agreement_id,))
+    cursor.execute(f"SELECT {', '.join(AGREEMENT_COLUMNS)} FROM agreements WHERE agreement_id = ?", (agreement_id,))
     row = cursor.fetchone()
     
     if not row:
         return None
     
-    agreement = dict(row)
-    
-    # Add calculated fields
-    total_pos = get_total_pos_value(conn, agreement_id)
-    ceiling_sar = convert_to_sar(agreement['agreement_value_ceiling'], agreement['currency'])
-    days_since = calculate_days_since_signature(agreement['signed_date'])
-    utilization = calculate_utilization(total_pos, ceiling_sar)
-    
-    agreement['total_pos_value_to_date'] = total_pos
-    agreement['is_monetizing'] = total_pos > 0
-    agreement['utilization_percent'] = utilization
-    agreement['days_since_signature'] = days_since
-    agreement['aging_bucket'] = calculate_aging_bucket(days_since)
-    agreement['risk_flag'] = calculate_risk_flag(
-        agreement['status'], days_since, total_pos, utilization
-    )
-    
-    return agreement
+    return add_calculated_fields(dict(row), get_total_pos_value(conn, agreement_id))
+
+# Agreement columns plus their SAR PO total (last column); append filters, then AGREEMENTS_ORDER_SQL
+AGREEMENTS_WITH_POS_TOTAL_TEMPLATE = f"""
+    SELECT {{columns}}, {POS_TOTAL_SAR_SQL} as total_pos_sar
+    FROM agreements a
+    LEFT JOIN pos p ON p.agreement_id = a.agreement_id
+    WHERE 1=1
+"""
+AGREEMENTS_WITH_POS_TOTAL_SQL = AGREEMENTS_WITH_POS_TOTAL_TEMPLATE.format(
+    columns=', '.join(f"a.{col}" for col in AGREEMENT_LIST_COLUMNS)
+)
+AGREEMENTS_EXPORT_SQL = AGREEMENTS_WITH_POS_TOTAL_TEMPLATE.format(
+    columns=', '.join(f"a.{col}" for col in AGREEMENT_COLUMNS)
+)
+# agreement_id breaks last_updated ties so every load of the list comes back in the same order
+AGREEMENTS_ORDER_SQL = " GROUP BY a.agreement_id ORDER BY a.last_updated DESC, a.agreement_id DESC"
 
-def get_all_agreements(conn: sqlite3.Connection, filters: Optional[Dict] = None) -> List[Dict]:
-    """Get all agreements with optional filters and calculated fields"""
+def get_all_agreements(conn: sqlite3.Connection, filters: Optional[Dict] = None,
+                       status_in: Optional[Iterable[str]] = None) -> List[Dict]:
+    """Get all agreements with optional filters, status_in pushed into SQL, and calculated fields"""
     cursor = conn.cursor()
     
-    query = "SELECT * FROM agreements WHERE 1=1"
+    # PO totals come from one LEFT JOIN ... GROUP BY instead of a query per agreement
+    query = AGREEMENTS_WITH_POS_TOTAL_SQL
     params = []
     
     if filters:
         if filters.get('status'):
-            query += " AND status = ?"
+            query += " AND a.status = ?"
             params.append(filters['status'])
         if filters.get('account_manager'):
-            query += " AND account_manager = ?"
+            query += " AND a.account_manager = ?"
             params.append(filters['account_manager'])
         if filters.get('customer_name'):
-            query += " AND customer_name LIKE ?"
+            query += " AND a.customer_name LIKE ?"
             params.append(f"%{filters['customer_name']}%")
         if filters.get('region'):
-            query += " AND region = ?"
+            query += " AND a.region = ?"
             params.append(filters['region'])
         if filters.get('industry'):
-            query += " AND industry = ?"
+            query += " AND a.industry = ?"
             params.append(filters['industry'])
         if filters.get('customer_segment'):
-            query += " AND customer_segment = ?"
+            query += " AND a.customer_segment = ?"
             params.append(filters['customer_segment'])
     
-    query += " ORDER BY last_updated DESC"
+    if status_in is not None:
+        status_in = list(status_in)
+        query += f" AND a.status IN ({', '.join('?' * len(status_in))})"
+        params.extend(status_in)
     
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
+    query += AGREEMENTS_ORDER_SQL
     
-    agreements = []
-    for row in rows:
-        agreement = dict(row)
-        
-        # Add calculated fields
-        total_pos = get_total_pos_value(conn, agreement['agreement_id'])
-        ceiling_sar = convert_to_sar(agreement['agreement_value_ceiling'], agreement['currency'])
-        days_since = calculate_days_since_signature(agreement['signed_date'])
-        utilization = calculate_utilization(total_pos, ceiling_sar)
-        
-        agreement['total_pos_value_to_date'] = total_pos
-        agreement['is_monetizing'] = total_pos > 0
-        agreement['utilization_percent'] = utilization
-        agreement['days_since_signature'] = days_since
-        agreement['aging_bucket'] = calculate_aging_bucket(days_since)
-        agreement['risk_flag'] = calculate_risk_flag(
-            agreement['status'], days_since, total_pos, utilization
-        )
-        
-        agreements.append(agreement)
+    # Plain tuples zipped against the column names skip building a sqlite3.Row per row
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    columns = [d[0] for d in cursor.description][:-1]
     
-    return agreements
+    today = date.today()
+    return [add_calculated_fields(dict(zip(columns, values)), total_pos, today)
+            for *values, total_pos in cursor.fetchall()]
 
 def delete_agreement(conn: sqlite3.Connection, agreement_id: str) -> bool:
-    """Delete an agreement and associated POs"""
+    """Delete an agreement and associated POs (run inside transaction(conn))"""
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM pos WHERE agreement_id = ?", (agreement_id,))
-    cursor.execute("DELETE FROM status_history WHERE agreement_id = ?", (agreement_id,))
+    # POs and status history go with it through ON DELETE CASCADE
     cursor.execute("DELETE FROM agreements WHERE agreement_id = ?", (agreement_id,))
-    conn.commit()
     return cursor.rowcount > 0
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PO CRUD OPERATIONS
 # ═══════════════════════════════════════════════════════════════════════════════
 
+PO_COLUMNS = (
+    'po_id', 'agreement_id', 'po_number', 'po_date', 'po_value', 'currency',
+    'customer_name', 'account_manager', 'notes', 'created_at', 'last_updated', 'value_sar',
+)
+PO_SELECT_SQL = f"SELECT {', '.join(PO_COLUMNS)} FROM pos"
+
+# Column order of po_row()
+PO_INSERT_COLUMNS = (
+    'po_id', 'agreement_id', 'po_number', 'po_date', 'po_value', 'currency',
+    'customer_name', 'account_manager', 'notes', 'created_at', 'last_updated',
+)
+PO_INSERT_SQL = insert_sql('pos', PO_INSERT_COLUMNS)
+
+def po_row(po_id: str, data: Dict[str, Any], agreement: Dict[str, Any], now: str) -> Tuple:
+    """Parameter tuple for PO_INSERT_SQL; customer and AM default to the agreement's"""
+    return (
+        po_id,
+        agreement['agreement_id'],
+        data.get('po_number'),
+        data.get('po_date'),
+        data.get('po_value'),
+        data.get('currency', 'SAR'),
+        data.get('customer_name', agreement['customer_name']),
+        data.get('account_manager', agreement['account_manager']),
+        data.get('notes'),
+        now,
+        now
+    )
+
+def validate_po_data(data: Dict[str, Any]) -> Optional[str]:
+    """Check a PO record against the table constraints; returns an error message or None"""
+    missing = [f for f in ('po_number', 'po_date', 'po_value') if data.get(f) is None]
+    if 'currency' in data and data['currency'] is None:
+        missing.append('currency')
+    if 'customer_name' in data and data['customer_name'] is None:
+        missing.append('customer_name')
+    if missing:
+        return f"missing {', '.join(missing)}"
+    try:
+        if float(data['po_value']) <= 0:
+            return "po_value must be positive"
+    except (TypeError, ValueError):
+        return "non-numeric po_value"
+    return None
+
 def create_po(conn: sqlite3.Connection, data: Dict[str, Any], override_ceiling: bool = False) -> str:
-    """Create a new PO"""
+    """Create a new PO (run inside transaction(conn))"""
     cursor = conn.cursor()
     
     agreement_id = data['agreement_id']
     
-    # Get agreement info
-    agreement = get_agreement(conn, agreement_id)
+    # Ceiling, PO total and the customer/AM defaults in one query
+    cursor.execute("""
+        SELECT a.agreement_id, a.customer_name, a.account_manager, a.ceiling_sar,
+               COALESCE((SELECT SUM(p.value_sar) FROM pos p WHERE p.agreement_id = a.agreement_id), 0) as total_pos_sar
+        FROM agreements a
+        WHERE a.agreement_id = ?
+    """, (agreement_id,))
+    agreement = cursor.fetchone()
     if not agreement:
         raise ValueError(f"Agreement {agreement_id} not found")
     
     # Check ceiling
     new_po_value_sar = convert_to_sar(data['po_value'], data.get('currency', 'SAR'))
-    current_total = agreement['total_pos_value_to_date']
-    ceiling_sar = convert_to_sar(agreement['agreement_value_ceiling'], agreement['currency'])
+    current_total = agreement['total_pos_sar']
+    ceiling_sar = agreement['ceiling_sar']
     
     if (current_total + new_po_value_sar) > ceiling_sar and not override_ceiling:
         raise ValueError(
@@ -506,109 +843,269 @@ def create_po(conn: sqlite3.Connection, data: Dict[str, Any], override_ceiling:
     po_id = generate_po_id(conn, agreement_id)
     now = datetime.now().isoformat()
     
-    cursor.execute("""
-        INSERT INTO pos (
-            po_id, agreement_id, po_number, po_date, po_value, currency,
-            customer_name, account_manager, notes, created_at, last_updated
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        po_id,
-        agreement_id,
-        data.get('po_number'),
-        data.get('po_date'),
-        data.get('po_value'),
-        data.get('currency', 'SAR'),
-        data.get('customer_name', agreement['customer_name']),
-        data.get('account_manager', agreement['account_manager']),
-        data.get('notes'),
-        now,
-        now
-    ))
+    cursor.execute(PO_INSERT_SQL, po_row(po_id, data, agreement, now))
     
-    conn.commit()
     return po_id
 
+def bulk_create_pos(conn: sqlite3.Connection, records: List[Dict[str, Any]],
+                    override_ceiling: bool = False,
+                    cursor: Optional[sqlite3.Cursor] = None) -> Tuple[List[str], List[str]]:
+    """Insert many POs in one transaction; returns (created PO IDs, per-row error messages)"""
+    cursor = cursor or conn.cursor()
+    
+    # Totals are read and checked under the write lock (BEGIN IMMEDIATE), so a concurrent
+    # PO can't push an agreement past its ceiling between the check and the insert
+    with transaction(conn):
+        # One grouped query gives each referenced agreement's ceiling and SAR total
+        agreement_ids = sorted({data.get('agreement_id') for data in records if data.get('agreement_id')})
+        agreements = {}
+        if agreement_ids:
+            placeholders = ', '.join('?' * len(agreement_ids))
+            cursor.execute(f"""
+                SELECT a.agreement_id, a.customer_name, a.account_manager,
+                       a.agreement_value_ceiling, a.currency, a.ceiling_sar,
+                       {POS_TOTAL_SAR_SQL} as total_pos_sar
+                FROM agreements a
+                LEFT JOIN pos p ON p.agreement_id = a.agreement_id
+                WHERE a.agreement_id IN ({placeholders})
+                GROUP BY a.agreement_id
+            """, agreement_ids)
+            agreements = {row['agreement_id']: dict(row) for row in cursor.fetchall()}
+        totals = {agreement_id: a['total_pos_sar'] for agreement_id, a in agreements.items()}
+        
+        accepted = []
+        errors = []
+        for i, data in enumerate(records, start=1):
+            agreement = agreements.get(data.get('agreement_id'))
+            if agreement is None:
+                errors.append(f"Row {i}: agreement {data.get('agreement_id')} not found")
+                continue
+            error = validate_po_data(data)
+            if error:
+                errors.append(f"Row {i}: {error}")
+                continue
+            
+            agreement_id = agreement['agreement_id']
+            if not override_ceiling:
+                new_total = totals[agreement_id] + convert_to_sar(float(data['po_value']), data.get('currency', 'SAR'))
+                if new_total > agreement['ceiling_sar']:
+                    errors.append(f"Row {i}: exceeds the ceiling of {agreement_id}")
+                    continue
+                totals[agreement_id] = new_total
+            
+            accepted.append((agreement, data))
+        
+        if not accepted:
+            return [], errors
+        
+        now = datetime.now().isoformat()
+        
+        # Reserve each agreement's block of PO IDs, then hand them out in record order
+        per_agreement = {}
+        for agreement, _ in accepted:
+            per_agreement[agreement['agreement_id']] = per_agreement.get(agreement['agreement_id'], 0) + 1
+        reserved = {agreement_id: iter(generate_po_ids(conn, agreement_id, count, cursor))
+                    for agreement_id, count in per_agreement.items()}
+        po_ids = [next(reserved[agreement['agreement_id']]) for agreement, _ in accepted]
+        insert_rows(cursor, 'pos', PO_INSERT_COLUMNS, [
+            po_row(po_id, data, agreement, now) for po_id, (agreement, data) in zip(po_ids, accepted)
+        ])
+    
+    return po_ids, errors
+
 def get_pos_for_agreement(conn: sqlite3.Connection, agreement_id: str) -> List[Dict]:
     """Get all POs for an agreement"""
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT * FROM pos WHERE agreement_id = ? ORDER BY po_date DESC
+    cursor.row_factory = None
+    cursor.execute(f"""
+        {PO_SELECT_SQL} WHERE agreement_id = ? ORDER BY po_date DESC
     """, (agreement_id,))
-    return [dict(row) for row in cursor.fetchall()]
+    return fetch_dicts(cursor)
 
 def get_all_pos(conn: sqlite3.Connection) -> List[Dict]:
     """Get all POs"""
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM pos ORDER BY po_date DESC")
-    return [dict(row) for row in cursor.fetchall()]
+    cursor.row_factory = None
+    cursor.execute(f"{PO_SELECT_SQL} ORDER BY po_date DESC")
+    return fetch_dicts(cursor)
 
 def delete_po(conn: sqlite3.Connection, po_id: str) -> bool:
-    """Delete a PO"""
+    """Delete a PO (run inside transaction(conn))"""
     cursor = conn.cursor()
     cursor.execute("DELETE FROM pos WHERE po_id = ?", (po_id,))
-    conn.commit()
     return cursor.rowcount > 0
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # ANALYTICS & KPIs
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def get_pipeline_stats(conn: sqlite3.Connection) -> Dict:
-    """Get pipeline overview statistics"""
-    agreements = get_all_agreements(conn)
+def get_kpi_summary(conn: sqlite3.Connection) -> Dict:
+    """Headline KPIs from SQL aggregates: agreement counts, pipeline/signed ceilings and monetized value in SAR"""
+    cursor = conn.cursor()
+    
+    summary = {
+        'total_agreements': 0,
+        'by_status': {},
+        'pipeline_ceiling': 0,
+        'signed_ceiling': 0,
+        'monetized_value': 0,
+        'overall_utilization': 0,
+    }
     
-    pre_signature = [a for a in agreements if a['status'] in [s.value for s in PRE_SIGNATURE_STATUSES]]
+    cursor.execute("""
+        SELECT status, COUNT(*) as n, SUM(ceiling_sar) as total
+        FROM agreements GROUP BY status
+    """)
+    for status, n, total in cursor.fetchall():
+        summary['total_agreements'] += n
+        summary['by_status'][status] = n
+        if status in PRE_SIGNATURE_VALUES:
+            summary['pipeline_ceiling'] += total
+        elif status in POST_SIGNATURE_VALUES:
+            summary['signed_ceiling'] += total
+    
+    placeholders = ', '.join('?' * len(POST_SIGNATURE_VALUES))
+    cursor.execute(f"""
+        SELECT COALESCE(SUM(p.value_sar), 0)
+        FROM pos p JOIN agreements a ON a.agreement_id = p.agreement_id
+        WHERE a.status IN ({placeholders})
+    """, tuple(POST_SIGNATURE_VALUES))
+    summary['monetized_value'] = cursor.fetchone()[0]
+    
+    if summary['signed_ceiling'] > 0:
+        summary['overall_utilization'] = (summary['monetized_value'] / summary['signed_ceiling']) * 100
+    
+    return summary
+
+# Named parameters for the Signed/Active statuses, bound alongside :today
+SIGNED_STATUS_PARAMS = {f'signed_status_{i}': status.value for i, status in enumerate(POST_SIGNATURE_STATUSES)}
+SIGNED_STATUS_IN_SQL = "a.status IN ({})".format(', '.join(f':{name}' for name in SIGNED_STATUS_PARAMS))
+
+# SQL form of calculate_aging_bucket over a "days" column, generated from AGING_BUCKET_EDGES
+AGING_BUCKET_CASE_SQL = "CASE WHEN days IS NULL THEN NULL {} ELSE '{}' END".format(
+    ' '.join(f"WHEN days < {edge} THEN '{label}'" for edge, label in zip(AGING_BUCKET_EDGES, AGING_BUCKET_LABELS)),
+    AGING_BUCKET_LABELS[-1],
+)
+
+# SQL form of calculate_risk_flag for Signed/Active rows: packs (day class, no POs, utilization < 10%)
+# into one integer and lists the RISK_FLAG_TABLE keys of each non-green flag
+RISK_KEY_SQL = "(({}) * 2 + (total_pos_sar = 0)) * 2 + (utilization < 10)".format(
+    ' + '.join(f'(days >= {edge})' for edge in RISK_DAY_EDGES)
+)
+SIGNED_RISK_KEYS = {
+    flag.value: [
+        str((day_class * 2 + no_pos) * 2 + low_utilization)
+        for (signed, day_class, no_pos, low_utilization), value in RISK_FLAG_TABLE.items()
+        if signed and value == flag.value
+    ]
+    for flag in RiskFlag
+}
+RISK_FLAG_CASE_SQL = "CASE WHEN days IS NULL THEN '{green}' {whens} ELSE '{green}' END".format(
+    green=RiskFlag.GREEN.value,
+    whens=' '.join(
+        f"WHEN {RISK_KEY_SQL} IN ({', '.join(keys)}) THEN '{flag}'"
+        for flag, keys in SIGNED_RISK_KEYS.items() if flag != RiskFlag.GREEN.value
+    ),
+)
+
+# Signed/Active agreements with their SAR ceiling, PO total, aging bucket and risk flag.
+# Mirrors add_calculated_fields; fill in {where} and bind signed_risk_params().
+# PO totals are summed once per matched agreement (MATERIALIZED) from the covering pos index.
+SIGNED_RISK_TEMPLATE = f"""
+    WITH signed AS MATERIALIZED (
+        SELECT a.agreement_id,
+               a.ceiling_sar as ceiling_sar,
+               (SELECT {POS_TOTAL_SAR_SQL} FROM pos p WHERE p.agreement_id = a.agreement_id) as total_pos_sar,
+               CAST(julianday(:today) - julianday(a.signed_date) AS INTEGER) as days
+        FROM agreements a
+        WHERE {{where}}
+    ),
+    utilized AS (
+        SELECT *,
+            CASE WHEN ceiling_sar > 0 THEN total_pos_sar / ceiling_sar * 100 ELSE 0.0 END as utilization
+        FROM signed
+    )
+    SELECT *,
+        {AGING_BUCKET_CASE_SQL} as aging_bucket,
+        {RISK_FLAG_CASE_SQL} as risk_flag
+    FROM utilized
+"""
+SIGNED_RISK_SQL = SIGNED_RISK_TEMPLATE.format(where=SIGNED_STATUS_IN_SQL)
+# Only agreements with a signed_date can be aged; lets the planner range-scan (status, signed_date)
+DATED_SIGNED_RISK_SQL = SIGNED_RISK_TEMPLATE.format(
+    where=f"{SIGNED_STATUS_IN_SQL} AND a.signed_date IS NOT NULL"
+)
+
+def signed_risk_params() -> Dict:
+    """Parameters for SIGNED_RISK_SQL / DATED_SIGNED_RISK_SQL as of today"""
+    return {'today': date.today().isoformat(), **SIGNED_STATUS_PARAMS}
+
+def get_pipeline_stats(conn: sqlite3.Connection) -> Dict:
+    """Get pipeline overview statistics, aggregated per status in SQL"""
+    cursor = conn.cursor()
     
     stats = {
-        'total_count': len(pre_signature),
-        'by_status': {},
+        'total_count': 0,
+        'by_status': {status.value: 0 for status in PRE_SIGNATURE_STATUSES},
         'total_potential_ceiling': 0,
         'avg_probability': 0,
         'weighted_value': 0,
     }
     
-    probabilities = []
-    
+    placeholders = ', '.join('?' * len(PRE_SIGNATURE_VALUES))
+    cursor.execute(f"""
+        SELECT a.status, COUNT(*) as n,
+               SUM(a.ceiling_sar) as ceiling_sar,
+               SUM(COALESCE(a.probability_to_sign, 0)) as probability_sum,
+               SUM(a.ceiling_sar * (COALESCE(a.probability_to_sign, 0) / 100.0)) as weighted
+        FROM agreements a
+        WHERE a.status IN ({placeholders})
+        GROUP BY a.status
+    """, tuple(PRE_SIGNATURE_VALUES))
+    rows = {row['status']: row for row in cursor.fetchall()}
+    
+    probability_sum = 0
     for status in PRE_SIGNATURE_STATUSES:
-        status_agreements = [a for a in pre_signature if a['status'] == status.value]
-        stats['by_status'][status.value] = len(status_agreements)
-        
-        for a in status_agreements:
-            ceiling_sar = convert_to_sar(a['agreement_value_ceiling'], a['currency'])
-            stats['total_potential_ceiling'] += ceiling_sar
-            
-            prob = a.get('probability_to_sign') or 0
-            probabilities.append(prob)
-            stats['weighted_value'] += ceiling_sar * (prob / 100)
+        row = rows.get(status.value)
+        if row is None:
+            continue
+        stats['by_status'][status.value] = row['n']
+        stats['total_count'] += row['n']
+        stats['total_potential_ceiling'] += row['ceiling_sar']
+        stats['weighted_value'] += row['weighted']
+        probability_sum += row['probability_sum']
     
-    stats['avg_probability'] = sum(probabilities) / len(probabilities) if probabilities else 0
+    stats['avg_probability'] = probability_sum / stats['total_count'] if stats['total_count'] else 0
     
     return stats
 
 def get_monetization_stats(conn: sqlite3.Connection) -> Dict:
-    """Get monetization statistics for signed agreements"""
-    agreements = get_all_agreements(conn)
-    
-    signed = [a for a in agreements if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]]
+    """Get monetization statistics for signed agreements, aggregated per risk flag in SQL"""
+    cursor = conn.cursor()
     
     stats = {
         'total_signed_ceiling': 0,
         'total_monetized_value': 0,
         'overall_utilization': 0,
         'agreements_without_pos': 0,
-        'agreements_count': len(signed),
-        'by_risk': {'Green': 0, 'Amber': 0, 'Red': 0},
+        'agreements_count': 0,
+        'by_risk': {flag.value: 0 for flag in RiskFlag},
     }
     
-    for a in signed:
-        ceiling_sar = convert_to_sar(a['agreement_value_ceiling'], a['currency'])
-        stats['total_signed_ceiling'] += ceiling_sar
-        stats['total_monetized_value'] += a['total_pos_value_to_date']
-        
-        if not a['is_monetizing']:
-            stats['agreements_without_pos'] += 1
-        
-        stats['by_risk'][a['risk_flag']] += 1
+    cursor.execute(f"""
+        SELECT risk_flag, COUNT(*) as n,
+               SUM(ceiling_sar) as ceiling_sar,
+               SUM(total_pos_sar) as total_pos_sar,
+               SUM(total_pos_sar <= 0) as without_pos
+        FROM ({SIGNED_RISK_SQL})
+        GROUP BY risk_flag
+    """, signed_risk_params())
+    for row in cursor.fetchall():
+        stats['by_risk'][row['risk_flag']] = row['n']
+        stats['agreements_count'] += row['n']
+        stats['total_signed_ceiling'] += row['ceiling_sar']
+        stats['total_monetized_value'] += row['total_pos_sar']
+        stats['agreements_without_pos'] += row['without_pos']
     
     if stats['total_signed_ceiling'] > 0:
         stats['overall_utilization'] = (stats['total_monetized_value'] / stats['total_signed_ceiling']) * 100
@@ -616,78 +1113,75 @@ def get_monetization_stats(conn: sqlite3.Connection) -> Dict:
     return stats
 
 def get_account_manager_stats(conn: sqlite3.Connection) -> List[Dict]:
-    """Get performance statistics by account manager"""
-    agreements = get_all_agreements(conn)
-    
-    am_stats = {}
-    
-    for a in agreements:
-        am = a['account_manager']
-        if am not in am_stats:
-            am_stats[am] = {
-                'account_manager': am,
-                'total_agreements': 0,
-                'signed_agreements': 0,
-                'signed_value': 0,
-                'monetized_value': 0,
-                'utilization': 0,
-                'avg_time_to_sign': [],
-            }
-        
-        am_stats[am]['total_agreements'] += 1
-        
-        if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]:
-            am_stats[am]['signed_agreements'] += 1
-            ceiling_sar = convert_to_sar(a['agreement_value_ceiling'], a['currency'])
-            am_stats[am]['signed_value'] += ceiling_sar
-            am_stats[am]['monetized_value'] += a['total_pos_value_to_date']
+    """Get performance statistics by account manager, aggregated in SQL"""
+    cursor = conn.cursor()
+    
+    placeholders = ', '.join('?' * len(POST_SIGNATURE_VALUES))
+    cursor.execute(f"""
+        SELECT a.account_manager,
+               COUNT(*) as total_agreements,
+               SUM(a.status IN ({placeholders})) as signed_agreements,
+               COALESCE(SUM(CASE WHEN a.status IN ({placeholders}) THEN a.ceiling_sar END), 0) as signed_value,
+               COALESCE(SUM(CASE WHEN a.status IN ({placeholders}) THEN p.total_pos_sar END), 0) as monetized_value
+        FROM agreements a
+        LEFT JOIN (
+            SELECT p.agreement_id, {POS_TOTAL_SAR_SQL} as total_pos_sar
+            FROM pos p GROUP BY p.agreement_id
+        ) p ON p.agreement_id = a.agreement_id
+        GROUP BY a.account_manager
+        ORDER BY monetized_value DESC, MAX(a.last_updated) DESC, MAX(a.agreement_id) DESC
+    """, tuple(POST_SIGNATURE_VALUES) * 3)
     
-    # Calculate utilization and format
     result = []
-    for am, stats in am_stats.items():
-        if stats['signed_value'] > 0:
-            stats['utilization'] = (stats['monetized_value'] / stats['signed_value']) * 100
+    for row in cursor.fetchall():
+        stats = dict(row)
+        stats['utilization'] = (stats['monetized_value'] / stats['signed_value']) * 100 if stats['signed_value'] > 0 else 0
+        stats['avg_time_to_sign'] = []
         result.append(stats)
     
-    return sorted(result, key=lambda x: x['monetized_value'], reverse=True)
+    return result
 
 def get_aging_risk_matrix(conn: sqlite3.Connection) -> Dict:
-    """Get aging vs risk heatmap data"""
-    agreements = get_all_agreements(conn)
-    signed = [a for a in agreements if a['status'] in [s.value for s in POST_SIGNATURE_STATUSES]]
+    """Get aging vs risk heatmap data as one grouped SQL query"""
+    cursor = conn.cursor()
     
     matrix = {}
     for bucket in AgingBucket:
-        matrix[bucket.value] = {'Green': 0, 'Amber': 0, 'Red': 0}
+        matrix[bucket.value] = {flag.value: 0 for flag in RiskFlag}
     
-    for a in signed:
-        bucket = a.get('aging_bucket')
-        risk = a.get('risk_flag', 'Green')
-        if bucket and bucket in matrix:
-            matrix[bucket][risk] += 1
+    cursor.execute(f"""
+        SELECT aging_bucket, risk_flag, COUNT(*) as n
+        FROM ({DATED_SIGNED_RISK_SQL})
+        WHERE aging_bucket IS NOT NULL
+        GROUP BY aging_bucket, risk_flag
+    """, signed_risk_params())
+    for bucket, risk, n in cursor.fetchall():
+        matrix[bucket][risk] = n
     
     return matrix
 
 def get_forecast_data(conn: sqlite3.Connection) -> Dict:
-    """Get forecast data for pipeline and monetization"""
-    agreements = get_all_agreements(conn)
-    pos = get_all_pos(conn)
+    """Get forecast data for pipeline and monetization, aggregated in SQL"""
+    cursor = conn.cursor()
     
     # Pre-signature forecast
-    pre_signature = [a for a in agreements if a['status'] in [s.value for s in PRE_SIGNATURE_STATUSES]]
-    expected_value = sum(
-        convert_to_sar(a['agreement_value_ceiling'], a['currency']) * (a.get('probability_to_sign') or 0) / 100
-        for a in pre_signature
-    )
+    placeholders = ', '.join('?' * len(PRE_SIGNATURE_VALUES))
+    cursor.execute(f"""
+        SELECT COALESCE(SUM(a.ceiling_sar * (COALESCE(a.probability_to_sign, 0) / 100.0)), 0)
+        FROM agreements a
+        WHERE a.status IN ({placeholders})
+    """, tuple(PRE_SIGNATURE_VALUES))
+    expected_value = cursor.fetchone()[0]
     
     # Monthly PO trend
-    monthly_pos = {}
-    for po in pos:
-        month = po['po_date'][:7] if po['po_date'] else None
-        if month:
-            if month not in monthly_pos:
-                monthly_pos[month] = 0
-            monthly_pos[month] += convert_to_sar(po['po_value'], po['currency'])
+    cursor.execute(f"""
+        SELECT substr(p.po_date, 1, 7) as month, {POS_TOTAL_SAR_SQL} as total
+        FROM pos p
+        WHERE p.po_date IS NOT NULL AND p.po_date != ''
+        GROUP BY month
+        ORDER BY month
+    """)
+    monthly_pos = {month: total for month, total in cursor.fetchall()}
     
     return {
         'expected_pipeline_value': expected_value,
@@ -698,17 +1192,28 @@ def get_forecast_data(conn: sqlite3.Connection) -> Dict:
 # DATA IMPORT/EXPORT
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def export_agreements_csv(conn: sqlite3.Connection) -> str:
-    """Export agreements to CSV format"""
+def iter_csv(fieldnames: List[str], rows: Iterable[Dict]) -> Iterator[str]:
+    """Yield CSV text one row at a time (header with the first row); yields nothing when there are no rows"""
     import csv
     import io
     
-    agreements = get_all_agreements(conn)
-    
-    if not agreements:
-        return ""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+    for i, row in enumerate(rows):
+        if i == 0:
+            writer.writeheader()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def iter_agreements_csv(conn: sqlite3.Connection) -> Iterator[str]:
+    """Stream agreements as CSV lines straight off the cursor"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(AGREEMENTS_EXPORT_SQL + AGREEMENTS_ORDER_SQL)
+    columns = [d[0] for d in cursor.description][:-1]
     
-    output = io.StringIO()
     fieldnames = [
         'agreement_id', 'agreement_name', 'customer_name', 'customer_segment',
         'region', 'industry', 'agreement_type', 'start_date', 'end_date',
@@ -718,34 +1223,28 @@ def export_agreements_csv(conn: sqlite3.Connection) -> str:
         'total_pos_value_to_date', 'utilization_percent', 'risk_flag', 'notes'
     ]
     
-    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
-    writer.writeheader()
-    
-    for a in agreements:
-        writer.writerow(a)
-    
-    return output.getvalue()
+    today = date.today()
+    rows = (add_calculated_fields(dict(zip(columns, values)), total_pos, today) for *values, total_pos in cursor)
+    return iter_csv(fieldnames, rows)
 
-def export_pos_csv(conn: sqlite3.Connection) -> str:
-    """Export POs to CSV format"""
-    import csv
-    import io
-    
-    pos = get_all_pos(conn)
-    
-    if not pos:
-        return ""
+def iter_pos_csv(conn: sqlite3.Connection) -> Iterator[str]:
+    """Stream POs as CSV lines straight off the cursor"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"{PO_SELECT_SQL} ORDER BY po_date DESC")
+    columns = [d[0] for d in cursor.description]
     
-    output = io.StringIO()
     fieldnames = [
         'po_id', 'agreement_id', 'po_number', 'po_date', 'po_value',
         'currency', 'customer_name', 'account_manager', 'notes'
     ]
     
-    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
-    writer.writeheader()
-    
-    for po in pos:
-        writer.writerow(po)
-    
-    return output.getvalue()
+    return iter_csv(fieldnames, (dict(zip(columns, values)) for values in cursor))
+
+def export_agreements_csv(conn: sqlite3.Connection) -> str:
+    """Export agreements to CSV format"""
+    return "".join(iter_agreements_csv(conn))
+
+def export_pos_csv(conn: sqlite3.Connection) -> str:
+    """Export POs to CSV format"""
+    return "".join(iter_pos_csv(conn))
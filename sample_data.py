@@ -4,9 +4,12 @@ Generates realistic sample data for testing and demonstration
 """
 
 from datetime import date, timedelta
+from functools import lru_cache
+import sqlite3
 import random
 from database import (
-    init_database, get_connection, create_agreement, create_po,
+    init_database, pooled_connection, transaction, bulk_create_agreements, bulk_create_pos,
+    drop_secondary_indexes, create_secondary_indexes,
     AgreementStatus, CustomerSegment, AgreementType, Currency
 )
 
@@ -54,153 +57,90 @@ AGREEMENT_NAMES = [
     "Digital Workspace Solutions",
 ]
 
+# Sample Agreements (10 total with various statuses), one tuple each:
+# (customer, name, type, status, ceiling, AM, probability, days until expected signature,
+#  days since signature, POs as (value, days ago)); customer and AM index the lists above
+SAMPLE_AGREEMENTS = (
+    # Pipeline, Draft, Legal Review, Signature Pending
+    (0, "AI Infrastructure Services Framework", AgreementType.FRAMEWORK, AgreementStatus.PIPELINE,
+     15000000, 0, 40, 90, None, ()),
+    (1, "NEOM Smart City Digital Twin", AgreementType.MASTER_SERVICES, AgreementStatus.DRAFT,
+     45000000, 1, 55, 60, None, ()),
+    (2, "Aramco AI Analytics Platform", AgreementType.FRAMEWORK, AgreementStatus.LEGAL_REVIEW,
+     28000000, 2, 70, 30, None, ()),
+    (3, "ROSHN Smart Living Solutions", AgreementType.FRAMEWORK, AgreementStatus.SIGNATURE_PENDING,
+     12000000, 3, 90, 7, None, ()),
+    # Signed - with POs (healthy)
+    (4, "MOH Healthcare AI Framework", AgreementType.FRAMEWORK, AgreementStatus.SIGNED,
+     35000000, 0, None, None, 45, ((5000000, 40), (8000000, 20))),
+    # Signed - no POs (amber risk)
+    (5, "Red Sea Tourism Analytics", AgreementType.MASTER_SERVICES, AgreementStatus.SIGNED,
+     22000000, 1, None, None, 55, ()),
+    # Active - with POs (good utilization)
+    (6, "STC Network Intelligence Suite", AgreementType.FRAMEWORK, AgreementStatus.ACTIVE,
+     50000000, 2, None, None, 180, ((12000000, 150), (15000000, 90), (8000000, 30))),
+    # Active - no POs (red risk - >90 days)
+    (7, "SABIC Industrial AI Platform", AgreementType.BLANKET_PO, AgreementStatus.ACTIVE,
+     18000000, 3, None, None, 120, ()),
+    # Active - low utilization (amber)
+    (8, "Riyadh Municipality Smart City", AgreementType.FRAMEWORK, AgreementStatus.ACTIVE,
+     40000000, 4, None, None, 100, ((2000000, 80),)),
+    # Signed - good monetization
+    (9, "KFSH Clinical AI Solutions", AgreementType.MASTER_SERVICES, AgreementStatus.SIGNED,
+     25000000, 0, None, None, 75, ((7000000, 60), (5000000, 30), (4000000, 10))),
+)
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # SAMPLE DATA GENERATION
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def generate_sample_data(db_path: str = "gtm_dashboard.db"):
-    """Generate sample agreements and POs"""
-    
+def expand_sample_agreement(spec: tuple, today: date) -> dict:
+    """Turn a SAMPLE_AGREEMENTS tuple into the dates and values used to build its records"""
+    customer, name, agreement_type, status, value, am, probability, sign_in, signed_ago, pos = spec
+    return {
+        "customer": CUSTOMERS[customer],
+        "name": name,
+        "type": agreement_type.value,
+        "status": status.value,
+        "value": value,
+        "probability": probability,
+        "expected_sign": today + timedelta(days=sign_in) if sign_in is not None else None,
+        "signed_date": today - timedelta(days=signed_ago) if signed_ago is not None else None,
+        "am": ACCOUNT_MANAGERS[am],
+        "pos": [{"value": po_value, "date": today - timedelta(days=ago)} for po_value, ago in pos],
+    }
+
+
+@lru_cache(maxsize=None)
+def init_database_once(db_path: str):
+    """init_database, skipped (no connection or version check) on later calls for the same path"""
     init_database(db_path)
-    conn = get_connection(db_path)
-    
+
+
+def generate_sample_data(db_path: str = "gtm_dashboard.db", verbose: bool = False):
+    """Generate sample agreements and POs (verbose lists every created row)"""
+    init_database_once(db_path)
+    with pooled_connection(db_path) as conn:
+        return insert_sample_data(conn, verbose)
+
+
+def insert_sample_data(conn: sqlite3.Connection, verbose: bool = False):
+    """Insert the sample agreements and POs on conn in one transaction; returns the agreement IDs"""
     today = date.today()
     
-    # Sample Agreements (10 total with various statuses)
-    sample_agreements = [
-        # Pipeline agreements
-        {
-            "customer": CUSTOMERS[0],
-            "name": "AI Infrastructure Services Framework",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.PIPELINE.value,
-            "value": 15000000,
-            "probability": 40,
-            "expected_sign": today + timedelta(days=90),
-            "am": ACCOUNT_MANAGERS[0],
-        },
-        # Draft
-        {
-            "customer": CUSTOMERS[1],
-            "name": "NEOM Smart City Digital Twin",
-            "type": AgreementType.MASTER_SERVICES.value,
-            "status": AgreementStatus.DRAFT.value,
-            "value": 45000000,
-            "probability": 55,
-            "expected_sign": today + timedelta(days=60),
-            "am": ACCOUNT_MANAGERS[1],
-        },
-        # Legal Review
-        {
-            "customer": CUSTOMERS[2],
-            "name": "Aramco AI Analytics Platform",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.LEGAL_REVIEW.value,
-            "value": 28000000,
-            "probability": 70,
-            "expected_sign": today + timedelta(days=30),
-            "am": ACCOUNT_MANAGERS[2],
-        },
-        # Signature Pending
-        {
-            "customer": CUSTOMERS[3],
-            "name": "ROSHN Smart Living Solutions",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.SIGNATURE_PENDING.value,
-            "value": 12000000,
-            "probability": 90,
-            "expected_sign": today + timedelta(days=7),
-            "am": ACCOUNT_MANAGERS[3],
-        },
-        # Signed - with POs (healthy)
-        {
-            "customer": CUSTOMERS[4],
-            "name": "MOH Healthcare AI Framework",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.SIGNED.value,
-            "value": 35000000,
-            "signed_date": today - timedelta(days=45),
-            "am": ACCOUNT_MANAGERS[0],
-            "pos": [
-                {"value": 5000000, "date": today - timedelta(days=40)},
-                {"value": 8000000, "date": today - timedelta(days=20)},
-            ]
-        },
-        # Signed - no POs (amber risk - 45 days)
-        {
-            "customer": CUSTOMERS[5],
-            "name": "Red Sea Tourism Analytics",
-            "type": AgreementType.MASTER_SERVICES.value,
-            "status": AgreementStatus.SIGNED.value,
-            "value": 22000000,
-            "signed_date": today - timedelta(days=55),
-            "am": ACCOUNT_MANAGERS[1],
-            "pos": []
-        },
-        # Active - with POs (good utilization)
-        {
-            "customer": CUSTOMERS[6],
-            "name": "STC Network Intelligence Suite",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.ACTIVE.value,
-            "value": 50000000,
-            "signed_date": today - timedelta(days=180),
-            "am": ACCOUNT_MANAGERS[2],
-            "pos": [
-                {"value": 12000000, "date": today - timedelta(days=150)},
-                {"value": 15000000, "date": today - timedelta(days=90)},
-                {"value": 8000000, "date": today - timedelta(days=30)},
-            ]
-        },
-        # Active - no POs (red risk - >90 days)
-        {
-            "customer": CUSTOMERS[7],
-            "name": "SABIC Industrial AI Platform",
-            "type": AgreementType.BLANKET_PO.value,
-            "status": AgreementStatus.ACTIVE.value,
-            "value": 18000000,
-            "signed_date": today - timedelta(days=120),
-            "am": ACCOUNT_MANAGERS[3],
-            "pos": []
-        },
-        # Active - low utilization (amber)
-        {
-            "customer": CUSTOMERS[8],
-            "name": "Riyadh Municipality Smart City",
-            "type": AgreementType.FRAMEWORK.value,
-            "status": AgreementStatus.ACTIVE.value,
-            "value": 40000000,
-            "signed_date": today - timedelta(days=100),
-            "am": ACCOUNT_MANAGERS[4],
-            "pos": [
-                {"value": 2000000, "date": today - timedelta(days=80)},
-            ]
-        },
-        # Signed - good monetization
-        {
-            "customer": CUSTOMERS[9],
-            "name": "KFSH Clinical AI Solutions",
-            "type": AgreementType.MASTER_SERVICES.value,
-            "status": AgreementStatus.SIGNED.value,
-            "value": 25000000,
-            "signed_date": today - timedelta(days=75),
-            "am": ACCOUNT_MANAGERS[0],
-            "pos": [
-                {"value": 7000000, "date": today - timedelta(days=60)},
-                {"value": 5000000, "date": today - timedelta(days=30)},
-                {"value": 4000000, "date": today - timedelta(days=10)},
-            ]
-        },
-    ]
-    
-    created_agreements = []
+    sample_agreements = [expand_sample_agreement(spec, today) for spec in SAMPLE_AGREEMENTS]
     
+    # Build every record first, then insert each table with the bulk helpers
+    agreement_records = []
+    today_iso = today.isoformat()
+    start_offsets = [random.randint(30, 180) for _ in sample_agreements]
+    sales_owners = random.choices(SALES_OWNERS, k=len(sample_agreements))
     for i, agr in enumerate(sample_agreements):
         customer = agr["customer"]
-        start_date = today - timedelta(days=random.randint(30, 180))
+        start_date = today - timedelta(days=start_offsets[i])
         end_date = start_date + timedelta(days=365 * 2)
         
-        agreement_data = {
+        agreement_records.append({
             "agreement_name": agr["name"],
             "customer_name": customer["name"],
             "customer_segment": customer["segment"],
@@ -212,58 +152,91 @@ def generate_sample_data(db_path: str = "gtm_dashboard.db"):
             "agreement_value_ceiling": agr["value"],
             "currency": "SAR",
             "status": agr["status"],
-            "status_date": today.isoformat(),
+            "status_date": today_iso,
             "account_manager": agr["am"],
-            "sales_owner": random.choice(SALES_OWNERS),
+            "sales_owner": sales_owners[i],
             "probability_to_sign": agr.get("probability"),
-            "expected_signature_date": agr.get("expected_sign", "").isoformat() if agr.get("expected_sign") else None,
-            "signed_date": agr.get("signed_date", "").isoformat() if agr.get("signed_date") else None,
+            "expected_signature_date": d.isoformat() if (d := agr.get("expected_sign")) else None,
+            "signed_date": d.isoformat() if (d := agr.get("signed_date")) else None,
             "notes": f"Sample agreement #{i+1} for testing purposes",
-        }
+        })
+    
+    # One transaction for the whole batch instead of a commit per row
+    with transaction(conn):
+        # One cursor for the whole load, shared with the bulk helpers
+        cursor = conn.cursor()
+        
+        # Into an empty database, build the indexes once after the load instead of per insert
+        empty = cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM agreements)").fetchone()[0]
+        if empty:
+            drop_secondary_indexes(conn)
         
-        agreement_id = create_agreement(conn, agreement_data)
-        created_agreements.append(agreement_id)
-        print(f"Created agreement: {agreement_id} - {agr['name']}")
+        created_agreements, errors = bulk_create_agreements(conn, agreement_records, cursor=cursor)
+        for error in errors:
+            print(f"Error creating agreement: {error}")
         
-        # Create POs if specified
-        for j, po in enumerate(agr.get("pos", [])):
-            po_data = {
-                "agreement_id": agreement_id,
-                "po_number": f"PO-{customer['name'][:3].upper()}-{today.year}-{j+1:03d}",
-                "po_date": po["date"].isoformat(),
-                "po_value": po["value"],
-                "currency": "SAR",
-                "customer_name": customer["name"],
-                "account_manager": agr["am"],
-                "notes": f"Purchase order for {agr['name']}",
-            }
+        po_records = []
+        for agreement_id, agr in zip(created_agreements, sample_agreements):
+            customer = agr["customer"]
+            if verbose:
+                print(f"Created agreement: {agreement_id} - {agr['name']}")
             
-            try:
-                po_id = create_po(conn, po_data)
-                print(f"  Created PO: {po_id} - {po['value']:,.0f} SAR")
-            except Exception as e:
-                print(f"  Error creating PO: {e}")
+            po_prefix = f"PO-{customer['name'][:3].upper()}-{today.year}"
+            po_notes = f"Purchase order for {agr['name']}"
+            for j, po in enumerate(agr.get("pos", []), start=1):
+                po_records.append({
+                    "agreement_id": agreement_id,
+                    "po_number": f"{po_prefix}-{j:03d}",
+                    "po_date": po["date"].isoformat(),
+                    "po_value": po["value"],
+                    "currency": "SAR",
+                    "customer_name": customer["name"],
+                    "account_manager": agr["am"],
+                    "notes": po_notes,
+                })
+        
+        po_ids, errors = bulk_create_pos(conn, po_records, cursor=cursor)
+        if verbose:
+            for po_id, po in zip(po_ids, po_records):
+                print(f"  Created PO: {po_id} - {po['po_value']:,.0f} SAR")
+        for error in errors:
+            print(f"  Error creating PO: {error}")
+        
+        if empty:
+            create_secondary_indexes(conn)
     
-    conn.close()
     print(f"\n✓ Created {len(created_agreements)} agreements with associated POs")
     return created_agreements
 
-
 def clear_all_data(db_path: str = "gtm_dashboard.db"):
     """Clear all data from the database"""
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM pos")
-    cursor.execute("DELETE FROM status_history")
-    cursor.execute("DELETE FROM agreements")
-    cursor.execute("UPDATE sequences SET seq_value = 0 WHERE seq_name = 'agreement'")
+    with pooled_connection(db_path) as conn:
+        delete_all_data(conn)
+
+
+def delete_all_data(conn: sqlite3.Connection):
+    """Delete every agreement, PO and history row on conn and reset the ID sequences"""
+    with transaction(conn):
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM pos")
+        cursor.execute("DELETE FROM status_history")
+        cursor.execute("DELETE FROM agreements")
+        cursor.execute("UPDATE sequences SET seq_value = 0 WHERE seq_name = 'agreement'")
+        cursor.execute("DELETE FROM sequences WHERE seq_name LIKE 'po:%'")
     
-    conn.commit()
-    conn.close()
     print("✓ All data cleared")
 
 
+def reset_sample_data(db_path: str = "gtm_dashboard.db", verbose: bool = False):
+    """Replace all data with fresh sample data in a single transaction"""
+    init_database_once(db_path)
+    
+    # Both helpers run on this connection, so their transactions join this one
+    with pooled_connection(db_path) as conn, transaction(conn):
+        delete_all_data(conn)
+        return insert_sample_data(conn, verbose)
+
+
 if __name__ == "__main__":
     print("Generating sample data...")
-    generate_sample_data()
+    generate_sample_data(verbose=True)